@@ -0,0 +1,130 @@
+import hashlib
+import io
+import json
+
+import numpy as np
+import pandas as pd
+from flask import Blueprint, Response, abort, request
+
+from data import CUBE_METRICS, COUNTRIES, getData
+from encoding import encode_values
+from metrics import timed
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    EXPORT_FORMATS = ('json', 'csv', 'arrow')
+except ImportError:
+    pyarrow = None
+    EXPORT_FORMATS = ('json', 'csv')
+
+MIMETYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Read-only export of the processed series, for consumers that would otherwise scrape the Dash callbacks. A body is
+# serialized once per dataset version and request, and its ETag is known without serializing it, so a poll of data
+# that did not change gets a 304.
+api = Blueprint('api', __name__, url_prefix='/api')
+
+
+def country_data(country):
+    country = country.upper()
+    if country not in COUNTRIES:
+        abort(404, f'Unknown country {country}')
+    return getData(country)
+
+
+def export_format():
+    fmt = request.args.get('format', 'json')
+    if fmt not in EXPORT_FORMATS:
+        abort(400, f'Unknown format {fmt}, one of {", ".join(EXPORT_FORMATS)}')
+    return fmt
+
+
+def requested_regions(cube):
+    regions = request.args.getlist('region') or list(cube.regions)
+    unknown = [ca for ca in regions if ca not in cube.regions]
+    if unknown:
+        abort(404, f'Unknown region {", ".join(unknown)}')
+    return regions
+
+
+def conditional(data, key, build, fmt):
+    cube = data.cube()
+    etag = hashlib.sha1(f'{key}:{cube.version}'.encode('utf-8')).hexdigest()
+    refresher = data.refresher
+    headers = {
+        # Clients can reuse a response until the background refresh is due to look for a new dataset.
+        'Cache-Control': f'public, max-age={int(max(0, refresher.refresh_after - (refresher.age() or 0)))}',
+        'X-Dataset-Version': cube.version,
+    }
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        cache_key = f'export{key}:{cube.version}'
+        body = data.figure_cache.get(cache_key)
+        if body is None:
+            body = build(cube)
+            data.figure_cache[cache_key] = body
+        response = Response(body, mimetype=MIMETYPES[fmt], headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+def long_frame(cube, regions):
+    # One row per region and date, the metrics as columns.
+    index = cube.regions.get_indexer(regions)
+    frame = pd.DataFrame(cube.values[index].reshape(-1, len(CUBE_METRICS)), columns=CUBE_METRICS)
+    frame.insert(0, 'region', np.repeat(np.asarray(regions, dtype=object), len(cube.dates)))
+    frame.insert(0, 'date', np.tile(cube.dates.to_numpy(), len(regions)))
+    return frame
+
+
+def serialize(frame, fmt):
+    if fmt == 'csv':
+        return frame.to_csv(index=False)
+    sink = io.BytesIO()
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+@api.route('/<country>/regions')
+@timed('api_regions')
+def regions(country):
+    data = country_data(country)
+    fmt = export_format()
+
+    def build(cube):
+        if fmt == 'json':
+            return json.dumps({'version': cube.version, 'regions': list(cube.regions)})
+        return serialize(pd.DataFrame({'region': list(cube.regions)}), fmt)
+
+    return conditional(data, f'regions:{fmt}', build, fmt)
+
+
+@api.route('/<country>/series')
+@timed('api_series')
+def series(country):
+    # ?region=A&region=B answers several regions in one call, no region means all of them.
+    data = country_data(country)
+    fmt = export_format()
+    regions = requested_regions(data.cube())
+
+    def build(cube):
+        if fmt == 'json':
+            index = cube.regions.get_indexer(regions)
+            return json.dumps({
+                'version': cube.version,
+                'dates': [date.isoformat() for date in cube.dates],
+                'regions': {ca: {metric: encode_values(cube.values[i, :, j], 'json')
+                                 for j, metric in enumerate(CUBE_METRICS)}
+                            for ca, i in zip(regions, index)},
+            })
+        return serialize(long_frame(cube, regions), fmt)
+
+    return conditional(data, f'series:{fmt}:{json.dumps(regions)}', build, fmt)
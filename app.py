@@ -1,22 +1,61 @@
+import os
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
-from dash.dependencies import Output, Input
-
-from components import build_figure_grid, selector, comparator_selector, box
-from data import getData
+import numpy as np
+import pandas as pd
+from dash.dependencies import ClientsideFunction, Input, MATCH, Output, State
+from dash.exceptions import PreventUpdate
+from flask import Response
+
+from api import api
+from components import cached_figure_grid, cached_figures, selector, comparator_selector, box, overview_placeholders, \
+    country_links, selector_options, comparator_options, comparator_controls
+from data import getData, country_from_path, COUNTRIES
+from downsample import downsample_bars, downsample_line
+from encoding import encode_figure
+from metrics import registry, timed
+from profiling import profile_requests, stage
 
 data = getData()
 
 Y_NCASES = 'Number of cases'
+Y_NCASES_PER_CAPITA = 'Cases per 100k inhabitants'
 Y_NCASESDELTA = 'Daily cases'
 Y_NCASESDELTAPRC = '% change'
 X_DATE = 'Date'
 
+# With CLIENTSIDE=1 the overview figures are derived in the browser (assets/clientside.js) from the raw series of each
+# region, sent once and kept in a dcc.Store.
+CLIENTSIDE = os.getenv('CLIENTSIDE') == '1'
+OVERVIEW_GRAPHS = [
+    ['all-cases'],
+    ['stacked', 'resume'],
+    ['all-delta', 'all-delta-pct'],
+    ['uci-delta', 'uci-delta-pct'],
+    ['recovered-delta', 'recovered-delta-pct'],
+    ['deaths-delta', 'deaths-delta-pct'],
+    ['exp-growth'],
+    ['diff-all'],
+]
+
+TABLE_PAGE_SIZE = 20
+TABLE_COLUMNS = [
+    {"name": 'All cases', "id": 'all'},
+    {"name": 'Active cases', "id": 'remaining'},
+    {"name": 'Recovered', "id": 'recovered'},
+    {"name": 'Cases in ICU', "id": 'uci'},
+    {"name": 'Deaths', "id": 'deaths'},
+]
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+                    ['contains ']]
+
 external_stylesheets = ['https://cdn.jsdelivr.net/npm/bulma@0.8.0/css/bulma.min.css']
 
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# The overview graphs the zoom callback targets only exist once fig_overview has rendered them.
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, suppress_callback_exceptions=True)
 app.title = data.dash_title()
 
 app.index_string = """<!DOCTYPE html>
@@ -48,42 +87,94 @@ app.index_string = """<!DOCTYPE html>
     </body>
 </html>"""
 
-app.layout = html.Div(className='container', children=[
-    html.Header(children=[
-        html.H1(className='title', children=data.dash_title()),
-
-        html.P(className='subtitle', children='''
-            Data exploration for covid-19.
-        ''')
-    ]),
-    html.Section(className='Content', children=[
-        html.Div(id='box', className='columns'),
-        dcc.Tabs([
-            dcc.Tab(label='Explore data', children=[
-                selector(),
-                html.Div(id='fig-overview'),
-                html.Div(id='table')
-            ]),
-            dcc.Tab(label='Comparision', children=[
-                comparator_selector(),
-                html.Div(id='fig-comparator')
+
+def serve_layout():
+    # Built per page load from the region manifest, so importing the app never downloads data.
+    return html.Div(className='container', children=[
+        dcc.Location(id='url', refresh=False),
+        country_links(COUNTRIES) if len(COUNTRIES) > 1 else None,
+        html.Header(children=[
+            html.H1(id='title', className='title', children=data.dash_title()),
+
+            html.P(className='subtitle', children='''
+                Data exploration for covid-19.
+            ''')
+        ]),
+        html.Section(className='Content', children=[
+            html.Div(id='box', className='columns'),
+            dcc.Tabs([
+                dcc.Tab(label='Explore data', children=[
+                    selector(data),
+                    html.Div(id='fig-overview',
+                             children=overview_placeholders(OVERVIEW_GRAPHS) if CLIENTSIDE else None),
+                    dcc.Store(id='series-request'),
+                    dcc.Store(id='series-new'),
+                    dcc.Store(id='series-store', data={}),
+                    # The version of the served dataset, looked up as often as the server refreshes it: the series
+                    # kept in the page are requested again once it changes.
+                    dcc.Store(id='dataset-version'),
+                    dcc.Interval(id='dataset-poll', interval=data.refresher.refresh_after * 1000,
+                                 disabled=not CLIENTSIDE),
+                    html.Div(id='table', children=[
+                        dash_table.DataTable(
+                            id='table-data',
+                            columns=TABLE_COLUMNS,
+                            page_current=0,
+                            page_size=TABLE_PAGE_SIZE,
+                            page_action='custom',
+                            sort_action='custom',
+                            sort_mode='multi',
+                            sort_by=[],
+                            filter_action='custom',
+                            filter_query='',
+                        ),
+                    ])
+                ]),
+                dcc.Tab(label='Comparision', children=[
+                    comparator_selector(data),
+                    comparator_controls(),
+                    html.Div(id='fig-comparator')
+                ]),
             ]),
         ]),
-    ]),
 
-    html.Footer(className='footer', children=[
-        html.Div(className='content has-text-centered', children=[
-            data.dash_data_ref()
+        html.Footer(className='footer', children=[
+            html.Div(id='data-ref', className='content has-text-centered', children=[
+                data.dash_data_ref()
+            ])
         ])
     ])
-])
+
+
+app.layout = serve_layout
+
+
+@app.callback(
+    [Output(component_id='title', component_property='children'),
+     Output(component_id='selector', component_property='options'),
+     Output(component_id='selector', component_property='value'),
+     Output(component_id='comporator-selector', component_property='options'),
+     Output(component_id='comporator-selector', component_property='value'),
+     Output(component_id='data-ref', component_property='children')],
+    [Input(component_id='url', component_property='pathname')]
+)
+@timed('page')
+def page(pathname):
+    # One app serves every country in COUNTRIES, picked by the first segment of the URL. The selections are reset,
+    # the regions of the previous country do not exist in this one.
+    data = getData(country_from_path(pathname))
+    return (data.dash_title(), selector_options(data), 'Total', comparator_options(data), None,
+            [data.dash_data_ref()])
 
 
 @app.callback(
     Output(component_id='box', component_property='children'),
-    [Input(component_id='selector', component_property='value')]
+    [Input(component_id='selector', component_property='value'),
+     Input(component_id='url', component_property='pathname')]
 )
-def info_box(ca):
+@timed('info_box')
+def info_box(ca, pathname):
+    data = getData(country_from_path(pathname))
     df = data.data_ccaa('Total')
 
     all = df["all"][-1]
@@ -100,82 +191,150 @@ def info_box(ca):
     ]
 
 
+def split_filter_part(filter_part):
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value_part = value_part.strip()
+                if value_part and value_part[0] == value_part[-1] and value_part[0] in ('"', "'", '`'):
+                    value = value_part[1:-1].replace('\\' + value_part[0], value_part[0])
+                elif operator_type[0] == 'contains ':
+                    # Matched against the cell text, which a float would no longer match ('1.0' in '12').
+                    value = value_part
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+def table_rows(data, ca, sort_by, filter_query):
+    # Filtered and sorted rows of a region, cached per region content so paging through them is a slice.
+    key = f'table{ca}:{data.cube().region_versions[ca]}:{sort_by}:{filter_query}'
+    df = data.derived_cache.get(key)
+    if df is None:
+        with stage('table_rows'):
+            df = data.data_ccaa(ca)[[column['id'] for column in TABLE_COLUMNS]].reset_index(drop=True)
+            # Whole numbers, except for the columns a province has no data for.
+            df = df.astype({column: 'int64' for column in df.columns if df[column].notna().all()})
+            for filter_part in filter_query.split(' && ') if filter_query else []:
+                name, operator, value = split_filter_part(filter_part)
+                if name not in df.columns:
+                    continue
+                if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+                    if isinstance(value, str) and pd.api.types.is_numeric_dtype(df[name]):
+                        # No number compares to text.
+                        df = df.iloc[:0]
+                        continue
+                    df = df.loc[getattr(df[name], operator)(value)]
+                elif operator == 'contains':
+                    df = df.loc[df[name].astype(str).str.contains(str(value), regex=False)]
+            if sort_by:
+                df = df.sort_values([col['column_id'] for col in sort_by],
+                                    ascending=[col['direction'] == 'asc' for col in sort_by])
+        data.derived_cache[key] = df
+    return df
+
+
 @app.callback(
-    Output(component_id='table', component_property='children'),
-    [Input(component_id='selector', component_property='value')]
+    [Output(component_id='table-data', component_property='data'),
+     Output(component_id='table-data', component_property='page_count')],
+    [Input(component_id='selector', component_property='value'),
+     Input(component_id='table-data', component_property='page_current'),
+     Input(component_id='table-data', component_property='page_size'),
+     Input(component_id='table-data', component_property='sort_by'),
+     Input(component_id='table-data', component_property='filter_query'),
+     Input(component_id='url', component_property='pathname')]
 )
-def table(ca):
-    df = data.data_ccaa(ca)
-    return dash_table.DataTable(
-        id='table-data',
-        columns=[
-            {"name": 'All cases', "id": 'all'},
-            {"name": 'Active cases', "id": 'remaining'},
-            {"name": 'Recovered', "id": 'recovered'},
-            {"name": 'Cases in ICU', "id": 'uci'},
-            {"name": 'Deaths', "id": 'deaths'},
-        ],
-        data=df.to_dict('records'),
-    )
+@timed('table')
+def table(ca, page_current, page_size, sort_by, filter_query, pathname):
+    # Only the requested page of the displayed columns goes over the wire.
+    df = table_rows(getData(country_from_path(pathname)), ca, sort_by, filter_query)
+    start = page_current * page_size
+    page = df.iloc[start:start + page_size]
+    return page.astype(object).where(page.notna(), None).to_dict('records'), max(1, -(-len(df) // page_size))
 
 
 @app.callback(
     Output(component_id='fig-comparator', component_property='children'),
-    [Input(component_id='comporator-selector', component_property='value')]
+    [Input(component_id='comporator-selector', component_property='value'),
+     Input(component_id='comparator-align', component_property='value'),
+     Input(component_id='comparator-scale', component_property='value'),
+     Input(component_id='url', component_property='pathname')]
 )
-def fig_comparator(ca):
-    if ca is None:
+@timed('fig_comparator')
+def fig_comparator(ca, align_cases, scale, pathname):
+    if not ca:
         return None
-    df = data.data_ccaa('Total')
+    data = getData(country_from_path(pathname))
+    per_capita = 'per_capita' in (scale or [])
+    key = f'comparator{ca}:{align_cases}:{per_capita}:{data.dataset_version()}'
+    return cached_figure_grid(data.figure_cache, key, lambda: comparator_grid(data, ca, align_cases, per_capita))
+
+
+def comparator_grid(data, ca, align_cases=None, per_capita=False):
+    # Every chart reads its traces from one comparison of the selected regions.
+    comparison = data.compare(ca, align_cases, per_capita)
+    series = comparison.series
+    x = comparison.x
+    x_title = f'Days since case {align_cases}' if align_cases else X_DATE
+    y_title = Y_NCASES_PER_CAPITA if per_capita else Y_NCASES
+
     all_cases = dcc.Graph(
         figure=dict(
-            data=[{'x': df.index, 'y': data.data_ccaa(x)['all'], 'name': x} for x in ca],
+            data=[{'x': x, 'y': series['all'][i], 'name': name} for i, name in enumerate(comparison.regions)],
             layout=dict(
-                title=f"All cases [{', '.join(ca)}]",
-                yaxis=dict(title=Y_NCASES),
-                xaxis=dict(title=X_DATE),
+                title=f"All cases [{', '.join(comparison.regions)}]",
+                yaxis=dict(title=y_title),
+                xaxis=dict(title=x_title),
             )
         ),
     )
 
     recovered = dcc.Graph(
         figure=dict(
-            data=[{'x': df.index, 'y': data.data_ccaa(x)['recovered'], 'name': x} for x in ca],
+            data=[{'x': x, 'y': series['recovered'][i], 'name': name} for i, name in enumerate(comparison.regions)],
             layout=dict(
-                title=f"Recovered [{', '.join(ca)}]",
-                yaxis=dict(title=Y_NCASES),
-                xaxis=dict(title=X_DATE),
+                title=f"Recovered [{', '.join(comparison.regions)}]",
+                yaxis=dict(title=y_title),
+                xaxis=dict(title=x_title),
             )
         ),
     )
 
     deaths = dcc.Graph(
         figure=dict(
-            data=[{'x': df.index, 'y': data.data_ccaa(x)['deaths'], 'name': x} for x in ca],
+            data=[{'x': x, 'y': series['deaths'][i], 'name': name} for i, name in enumerate(comparison.regions)],
             layout=dict(
-                title=f"Deaths [{', '.join(ca)}]",
-                yaxis=dict(title=Y_NCASES),
-                xaxis=dict(title=X_DATE),
+                title=f"Deaths [{', '.join(comparison.regions)}]",
+                yaxis=dict(title=y_title),
+                xaxis=dict(title=x_title),
             )
         ),
     )
 
     daily_pct_increase = dcc.Graph(
         figure=dict(
-            data=[{'type': 'bar', 'x': df.index, 'y': 100*data.data_ccaa(x)['all'].pct_change(), 'name': x} for x in ca],
+            data=[{'type': 'bar', 'x': x, 'y': series['all_pct_change'][i], 'name': name}
+                  for i, name in enumerate(comparison.regions)],
             layout=dict(
-                title=f"Daily % infection change [{', '.join(ca)}]",
+                title=f"Daily % infection change [{', '.join(comparison.regions)}]",
                 yaxis=dict(title='% change'),
-                xaxis=dict(title=X_DATE),
+                xaxis=dict(title=x_title),
             ),
         ),
     )
 
     fig_diff_all = dcc.Graph(
         figure=dict(
-            data=[{'x': data.data_ccaa(x)['all'], 'y': data.data_ccaa(x)['all'].diff().rolling(window=3).mean(), 'name': x} for x in ca],
+            data=[{'x': series['all'][i], 'y': series['all_delta_avg3'][i], 'name': name}
+                  for i, name in enumerate(comparison.regions)],
             layout=dict(
-                title=f"Trajectory of confirmed cases (log scale) [{', '.join(ca)}]",
+                title=f"Trajectory of confirmed cases (log scale) [{', '.join(comparison.regions)}]",
                 yaxis={'type': 'log', 'autorange': True, 'title': 'New confirmed cases'},
                 xaxis={'type': 'log', 'autorange': True, 'title': 'Total confirmed cases'},
                 height=800
@@ -189,234 +348,377 @@ def fig_comparator(ca):
         [daily_pct_increase],
         [fig_diff_all]
     ]
-    return build_figure_grid(layout_grid)
+    return layout_grid
 
 
-@app.callback(
-    Output(component_id='fig-overview', component_property='children'),
-    [Input(component_id='selector', component_property='value')]
-)
-def fig_overview(ca):
-    df = data.data_ccaa(ca)
-    exp1, exp2, exp3, exp4 = data.data_exp()
-    fig_all_cases = dcc.Graph(
-        figure=dict(
-            data=[
-                {'x': df.index, 'y': df['all'], 'name': 'Confirmed cases'},
-                {'x': df.index, 'y': data.exp_fit(df['all'], ca), 'name': 'Exponential model',
-                 'line': {'dash': 'dash', 'width': 1}},
-                {'x': df.index, 'y': df['remaining'] + df['uci'], 'name': 'Active cases'},
-            ],
-            layout=dict(
-                title=f"All cases with exponential model calculated 5days ago [{ca}] ",
-                yaxis=dict(title=Y_NCASES),
-                xaxis=dict(title=X_DATE),
-                height=800
-            )
-        ),
+def overview_key(data, ca):
+    return f'overview{ca}:{data.cube().region_versions[ca]}'
+
+
+@timed('fig_overview')
+def fig_overview(ca, pathname):
+    data = getData(country_from_path(pathname))
+    ids = [[{'type': 'overview', 'name': name} for name in row] for row in OVERVIEW_GRAPHS]
+    return cached_figure_grid(data.figure_cache, overview_key(data, ca), lambda: overview_grid(data, ca), ids)
+
+
+def relayout_window(relayout):
+    # The dates shown after a zoom or a pan, None after a reset, False when the x axis did not change.
+    if not relayout:
+        return False
+    if relayout.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout:
+        return relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    if 'xaxis.range' in relayout:
+        return tuple(relayout['xaxis.range'])
+    return False
+
+
+@timed('zoom_overview')
+def zoom_overview(relayout, ca, pathname, graph):
+    # The overview is sent downsampled. Zooming into one of its charts sends that chart again with every point of the
+    # visible dates (or as many as OVERVIEW_POINTS allows), a reset sends back the downsampled history.
+    window = relayout_window(relayout)
+    if window is False or graph['name'] == 'diff-all':
+        raise PreventUpdate
+    data = getData(country_from_path(pathname))
+    if window is None:
+        names = [name for row in OVERVIEW_GRAPHS for name in row]
+        figures = cached_figures(data.figure_cache, overview_key(data, ca), lambda: overview_grid(data, ca))
+        return [figure for row in figures for figure in row][names.index(graph['name'])]
+    with stage('figures'):
+        figure = OVERVIEW_FIGURES[graph['name']](data, ca, *overview_series(data, ca, window))
+    with stage('encode'):
+        figure = encode_figure(figure)
+    figure['layout'] = dict(figure['layout'], xaxis=dict(figure['layout']['xaxis'], range=list(window)))
+    return figure
+
+
+@timed('series')
+def series(request):
+    if request is None:
+        raise PreventUpdate
+    data = getData(country_from_path(request['pathname']))
+    return dict(data.raw_series(request['region']), key=request['key'], dataset=data.dataset_version())
+
+
+@timed('dataset_version')
+def dataset_version(n_intervals, pathname):
+    return getData(country_from_path(pathname)).dataset_version()
+
+
+if CLIENTSIDE:
+    # A region already in the store is rendered without any request to the server, until the dataset changes.
+    app.callback(
+        Output(component_id='dataset-version', component_property='data'),
+        [Input(component_id='dataset-poll', component_property='n_intervals'),
+         Input(component_id='url', component_property='pathname')]
+    )(dataset_version)
+    app.clientside_callback(
+        ClientsideFunction(namespace='covid', function_name='request_series'),
+        Output(component_id='series-request', component_property='data'),
+        [Input(component_id='selector', component_property='value'),
+         Input(component_id='url', component_property='pathname'),
+         Input(component_id='dataset-version', component_property='data')],
+        [State(component_id='series-store', component_property='data')]
+    )
+    app.callback(
+        Output(component_id='series-new', component_property='data'),
+        [Input(component_id='series-request', component_property='data')]
+    )(series)
+    app.clientside_callback(
+        ClientsideFunction(namespace='covid', function_name='merge_series'),
+        Output(component_id='series-store', component_property='data'),
+        [Input(component_id='series-new', component_property='data')],
+        [State(component_id='series-store', component_property='data')]
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='covid', function_name='overview'),
+        [Output(component_id=f'overview-{name}', component_property='figure')
+         for row in OVERVIEW_GRAPHS for name in row],
+        [Input(component_id='selector', component_property='value'),
+         Input(component_id='url', component_property='pathname'),
+         Input(component_id='series-store', component_property='data'),
+         Input(component_id='dataset-version', component_property='data')]
     )
+else:
+    app.callback(
+        Output(component_id='fig-overview', component_property='children'),
+        [Input(component_id='selector', component_property='value'),
+         Input(component_id='url', component_property='pathname')]
+    )(fig_overview)
+    app.callback(
+        Output(component_id={'type': 'overview', 'name': MATCH}, component_property='figure'),
+        [Input(component_id={'type': 'overview', 'name': MATCH}, component_property='relayoutData')],
+        [State(component_id='selector', component_property='value'),
+         State(component_id='url', component_property='pathname'),
+         State(component_id={'type': 'overview', 'name': MATCH}, component_property='id')]
+    )(zoom_overview)
+
+
+# name: function(data, ca, df, line, means) building the figure of that overview chart.
+OVERVIEW_FIGURES = {}
+
+
+def overview_figure(name):
+    def register(build):
+        OVERVIEW_FIGURES[name] = build
+        return build
+    return register
+
+
+def overview_series(data, ca, window=None):
+    # The region's frame and how its series are sent: only the dates in `window` (start, end) when it is given, at most
+    # OVERVIEW_POINTS per trace. Lines keep their shape with LTTB, bars and the stacked areas, whose traces must share
+    # their dates, are averaged per bucket.
+    df = data.data_ccaa(ca)
+    part = slice(None) if window is None else df.index.slice_indexer(*(pd.Timestamp(date) for date in window))
+    dates = df.index[part]
 
-    fig_resume = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': df['remaining'], 'name': 'Other confirmed',
-                 'marker': {'color': 'darkorange'}},
-                {'type': 'bar', 'x': df.index, 'y': df['uci'], 'name': 'Cases in ICU', 'marker': {'color': 'crimson'}},
-                {'type': 'bar', 'x': df.index, 'y': df['recovered'], 'name': 'Recovered',
-                 'marker': {'color': 'forestgreen'}},
-                {'type': 'bar', 'x': df.index, 'y': df['deaths'], 'name': 'Deaths', 'marker': {'color': 'black'}},
-            ],
-            layout=dict(
-                title=f"Daily cases distribution [{ca}]",
-                barmode='stack',
-                yaxis=dict(title=Y_NCASES),
-                xaxis=dict(title=X_DATE),
-            )
-        ),
+    def line(y):
+        return downsample_line(dates, np.asarray(y)[part])
+
+    def means(y):
+        return downsample_bars(dates, np.asarray(y)[part])
+
+    return df, line, means
+
+
+def overview_grid(data, ca, window=None):
+    df, line, means = overview_series(data, ca, window)
+    return [[dcc.Graph(figure=OVERVIEW_FIGURES[name](data, ca, df, line, means)) for name in row]
+            for row in OVERVIEW_GRAPHS]
+
+
+@overview_figure('all-cases')
+def fig_all_cases(data, ca, df, line, means):
+    return dict(
+        data=[
+            {**line(df['all']), 'name': 'Confirmed cases'},
+            {**line(data.exp_fit(ca)), 'name': 'Exponential model',
+             'line': {'dash': 'dash', 'width': 1}},
+            {**line(data.metric('active', ca)), 'name': 'Active cases'},
+        ],
+        layout=dict(
+            title=f"All cases with exponential model calculated 5days ago [{ca}] ",
+            yaxis=dict(title=Y_NCASES),
+            xaxis=dict(title=X_DATE),
+            height=800
+        )
     )
 
-    fig_all_cases_delta = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': df['all'].diff()},
-            ],
-            layout=dict(
-                title=f"Daily new contagious [{ca}]",
-                yaxis=dict(title=Y_NCASESDELTA),
-                xaxis=dict(title=X_DATE),
-            ),
 
-        ),
+@overview_figure('resume')
+def fig_resume(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(df['remaining']), 'name': 'Other confirmed',
+             'marker': {'color': 'darkorange'}},
+            {'type': 'bar', **means(df['uci']), 'name': 'Cases in ICU', 'marker': {'color': 'crimson'}},
+            {'type': 'bar', **means(df['recovered']), 'name': 'Recovered',
+             'marker': {'color': 'forestgreen'}},
+            {'type': 'bar', **means(df['deaths']), 'name': 'Deaths', 'marker': {'color': 'black'}},
+        ],
+        layout=dict(
+            title=f"Daily cases distribution [{ca}]",
+            barmode='stack',
+            yaxis=dict(title=Y_NCASES),
+            xaxis=dict(title=X_DATE),
+        )
     )
 
-    fig_all_cases_delta_pct = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': 100*df['all'].pct_change()},
-            ],
-            layout=dict(
-                title=f"% increase of new cases [{ca}]",
-                yaxis=dict(title=Y_NCASESDELTAPRC),
-                xaxis=dict(title=X_DATE),
-            ),
+
+@overview_figure('all-delta')
+def fig_all_cases_delta(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(data.metric('all_delta', ca))},
+        ],
+        layout=dict(
+            title=f"Daily new contagious [{ca}]",
+            yaxis=dict(title=Y_NCASESDELTA),
+            xaxis=dict(title=X_DATE),
         ),
     )
 
-    fig_icus_cases_delta = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': df['uci'].diff(),
-                 'marker': {'color': 'crimson'}},
-            ],
-            layout=dict(
-                title=f"Daily new cases in ICU [{ca}]",
-                yaxis=dict(title=Y_NCASESDELTA),
-                xaxis=dict(title=X_DATE),
-            ),
+
+@overview_figure('all-delta-pct')
+def fig_all_cases_delta_pct(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(data.metric('all_pct_change', ca))},
+        ],
+        layout=dict(
+            title=f"% increase of new cases [{ca}]",
+            yaxis=dict(title=Y_NCASESDELTAPRC),
+            xaxis=dict(title=X_DATE),
         ),
     )
 
-    fig_icus_cases_delta_pct = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': 100*df['uci'].pct_change(),
-                 'marker': {'color': 'crimson'}},
-            ],
-            layout=dict(
-                title=f"% increase of ICU [{ca}]",
-                yaxis=dict(title=Y_NCASESDELTAPRC),
-                xaxis=dict(title=X_DATE),
-            ),
+
+@overview_figure('uci-delta')
+def fig_icus_cases_delta(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(data.metric('uci_delta', ca)),
+             'marker': {'color': 'crimson'}},
+        ],
+        layout=dict(
+            title=f"Daily new cases in ICU [{ca}]",
+            yaxis=dict(title=Y_NCASESDELTA),
+            xaxis=dict(title=X_DATE),
         ),
     )
 
-    fig_recovered_cases_delta = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': df['recovered'].diff(),
-                 'marker': {'color': 'forestgreen'}},
-            ],
-            layout=dict(
-                title=f"Daily new recovered cases [{ca}]",
-                yaxis=dict(title=Y_NCASESDELTA),
-                xaxis=dict(title=X_DATE),
-            ),
+
+@overview_figure('uci-delta-pct')
+def fig_icus_cases_delta_pct(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(data.metric('uci_pct_change', ca)),
+             'marker': {'color': 'crimson'}},
+        ],
+        layout=dict(
+            title=f"% increase of ICU [{ca}]",
+            yaxis=dict(title=Y_NCASESDELTAPRC),
+            xaxis=dict(title=X_DATE),
         ),
     )
 
-    fig_recovered_cases_delta_pct = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': 100*df['recovered'].pct_change(),
-                 'marker': {'color': 'forestgreen'}},
-            ],
-            layout=dict(
-                title=f"% increase of recovered [{ca}]",
-                yaxis=dict(title=Y_NCASESDELTAPRC),
-                xaxis=dict(title=X_DATE),
-            ),
+
+@overview_figure('recovered-delta')
+def fig_recovered_cases_delta(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(data.metric('recovered_delta', ca)),
+             'marker': {'color': 'forestgreen'}},
+        ],
+        layout=dict(
+            title=f"Daily new recovered cases [{ca}]",
+            yaxis=dict(title=Y_NCASESDELTA),
+            xaxis=dict(title=X_DATE),
         ),
     )
 
-    fig_deaths_cases_delta = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': df['deaths'].diff(),
-                 'marker': {'color': 'black'}},
-            ],
-            layout=dict(
-                title=f"Daily deaths [{ca}]",
-                yaxis=dict(title=Y_NCASESDELTA),
-                xaxis=dict(title=X_DATE),
-            ),
+
+@overview_figure('recovered-delta-pct')
+def fig_recovered_cases_delta_pct(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(data.metric('recovered_pct_change', ca)),
+             'marker': {'color': 'forestgreen'}},
+        ],
+        layout=dict(
+            title=f"% increase of recovered [{ca}]",
+            yaxis=dict(title=Y_NCASESDELTAPRC),
+            xaxis=dict(title=X_DATE),
         ),
     )
 
-    fig_deaths_cases_delta_pct = dcc.Graph(
-        figure=dict(
-            data=[
-                {'type': 'bar', 'x': df.index, 'y': 100*df['deaths'].pct_change(),
-                 'marker': {'color': 'black'}},
-            ],
-            layout=dict(
-                title=f"% increase of deaths [{ca}]",
-                yaxis=dict(title=Y_NCASESDELTAPRC),
-                xaxis=dict(title=X_DATE),
-            ),
+
+@overview_figure('deaths-delta')
+def fig_deaths_cases_delta(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(data.metric('deaths_delta', ca)),
+             'marker': {'color': 'black'}},
+        ],
+        layout=dict(
+            title=f"Daily deaths [{ca}]",
+            yaxis=dict(title=Y_NCASESDELTA),
+            xaxis=dict(title=X_DATE),
         ),
     )
 
-    fig_exp_growth = dcc.Graph(
-        figure=dict(
-            data=[
-                {'x': df.index, 'y': df['all'], 'name': 'All cases'},
-                {'x': df.index, 'y': exp1, 'name': 'Doubling cases every day',
-                 'line': {'dash': 'dash', 'width': 1}},
-                {'x': df.index, 'y': exp2, 'name': 'Doubling cases every 2 days',
-                 'line': {'dash': 'dash', 'width': 1}},
-                {'x': df.index, 'y': exp3, 'name': 'Doubling cases every 3 days',
-                 'line': {'dash': 'dash', 'width': 1}},
-                {'x': df.index, 'y': exp4, 'name': 'Doubling cases every 4 days',
-                 'line': {'dash': 'dash', 'width': 1}},
-            ],
-            layout=dict(
-                title=f"Exponential growth overview (log scale) [{ca}]",
-                yaxis={'type': 'log', 'autorange': True, 'title': Y_NCASES},
-                xaxis=dict(title=X_DATE),
-                height=800
-            )
+
+@overview_figure('deaths-delta-pct')
+def fig_deaths_cases_delta_pct(data, ca, df, line, means):
+    return dict(
+        data=[
+            {'type': 'bar', **means(data.metric('deaths_pct_change', ca)),
+             'marker': {'color': 'black'}},
+        ],
+        layout=dict(
+            title=f"% increase of deaths [{ca}]",
+            yaxis=dict(title=Y_NCASESDELTAPRC),
+            xaxis=dict(title=X_DATE),
         ),
     )
 
-    fig_diff_all = dcc.Graph(
-        figure=dict(
-            data=[
-                {'x': df['all'], 'y': df['all'].diff().rolling(window=3).mean(), 'name': 'All cases'},
-            ],
-            layout=dict(
-                title=f"Trajectory of confirmed cases (log scale) [{ca}]",
-                yaxis={'type': 'log', 'autorange': True, 'title': 'New confirmed cases'},
-                xaxis={'type': 'log', 'autorange': True, 'title': 'Total confirmed cases'},
-                height=800
-            )
-        ),
+
+@overview_figure('exp-growth')
+def fig_exp_growth(data, ca, df, line, means):
+    exp1, exp2, exp3, exp4 = data.data_exp()
+    return dict(
+        data=[
+            {**line(df['all']), 'name': 'All cases'},
+            {**line(exp1), 'name': 'Doubling cases every day',
+             'line': {'dash': 'dash', 'width': 1}},
+            {**line(exp2), 'name': 'Doubling cases every 2 days',
+             'line': {'dash': 'dash', 'width': 1}},
+            {**line(exp3), 'name': 'Doubling cases every 3 days',
+             'line': {'dash': 'dash', 'width': 1}},
+            {**line(exp4), 'name': 'Doubling cases every 4 days',
+             'line': {'dash': 'dash', 'width': 1}},
+        ],
+        layout=dict(
+            title=f"Exponential growth overview (log scale) [{ca}]",
+            yaxis={'type': 'log', 'autorange': True, 'title': Y_NCASES},
+            xaxis=dict(title=X_DATE),
+            height=800
+        )
     )
 
-    fig_stacked = dcc.Graph(
-        figure=dict(
-            data=[
-                {'x': df.index, 'y': df['remaining_pct'], 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Other Confirmed',
-                 'line': {'color': 'darkorange'}},
-                {'x': df.index, 'y': df['recovered_pct'], 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Recovered',
-                 'line': {'color': 'forestgreen'}},
-                {'x': df.index, 'y': df['uci_pct'], 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Icus',
-                 'line': {'color': 'crimson'}},
-                {'x': df.index, 'y': df['deaths_pct'], 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Deaths',
-                 'line': {'color': 'black'}},
-            ],
-            layout=dict(
-                title=f"% Distribution of the cases across phases [{ca}]",
-                yaxis={'range': [0, 100], 'title': 'Stacked percentage of cases'},
-                xaxis={'title': X_DATE},
-            )
-        ),
+
+@overview_figure('diff-all')
+def fig_diff_all(data, ca, df, line, means):
+    # The trajectory has the cases as x axis, it is never cut to a window.
+    all_cases = df['all'].to_numpy()
+    return dict(
+        data=[
+            {**downsample_line(all_cases, data.metric('all_delta_avg3', ca), position=all_cases),
+             'name': 'All cases'},
+        ],
+        layout=dict(
+            title=f"Trajectory of confirmed cases (log scale) [{ca}]",
+            yaxis={'type': 'log', 'autorange': True, 'title': 'New confirmed cases'},
+            xaxis={'type': 'log', 'autorange': True, 'title': 'Total confirmed cases'},
+            height=800
+        )
     )
 
-    layout_grid = [
-        [fig_all_cases, ],
-        [fig_stacked, fig_resume],
-        [fig_all_cases_delta, fig_all_cases_delta_pct],
-        [fig_icus_cases_delta, fig_icus_cases_delta_pct],
-        [fig_recovered_cases_delta, fig_recovered_cases_delta_pct],
-        [fig_deaths_cases_delta, fig_deaths_cases_delta_pct],
-        [fig_exp_growth, ],
-        [fig_diff_all, ],
-    ]
 
-    return build_figure_grid(layout_grid)
+@overview_figure('stacked')
+def fig_stacked(data, ca, df, line, means):
+    return dict(
+        data=[
+            {**means(df['remaining_pct']), 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Other Confirmed',
+             'line': {'color': 'darkorange'}},
+            {**means(df['recovered_pct']), 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Recovered',
+             'line': {'color': 'forestgreen'}},
+            {**means(df['uci_pct']), 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Icus',
+             'line': {'color': 'crimson'}},
+            {**means(df['deaths_pct']), 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Deaths',
+             'line': {'color': 'black'}},
+        ],
+        layout=dict(
+            title=f"% Distribution of the cases across phases [{ca}]",
+            yaxis={'range': [0, 100], 'title': 'Stacked percentage of cases'},
+            xaxis={'title': X_DATE},
+        )
+    )
 
 
 server = app.server
+server.register_blueprint(api)
+profile_requests(server)
+
+
+@server.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 
 if __name__ == '__main__':
     app.run_server(debug=True)
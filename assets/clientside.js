@@ -0,0 +1,215 @@
+// Client side mode (CLIENTSIDE=1): the server sends the raw cumulative series of a region once, the overview figures
+// are derived here. Mirrors overview_grid() in app.py.
+(function () {
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        covid: {
+            request_series: function (ca, pathname, version, store) {
+                if (!ca || !version || current(store, ca, pathname, version)) {
+                    return window.dash_clientside.no_update;
+                }
+                return {'key': seriesKey(ca, pathname), 'region': ca, 'pathname': pathname};
+            },
+
+            merge_series: function (series, store) {
+                if (!series) {
+                    return window.dash_clientside.no_update;
+                }
+                // The series of the same country from another dataset are stale, they are dropped.
+                var merged = {};
+                var prefix = series.key.slice(0, series.key.indexOf('|') + 1);
+                Object.keys(store || {}).forEach(function (key) {
+                    if (key.indexOf(prefix) !== 0 || store[key].dataset === series.dataset) {
+                        merged[key] = store[key];
+                    }
+                });
+                merged[series.key] = series;
+                return merged;
+            },
+
+            overview: function (ca, pathname, store, version) {
+                var s = current(store, ca, pathname, version);
+                if (!s) {
+                    return Array(13).fill(window.dash_clientside.no_update);
+                }
+                var x = dates(s);
+                var remaining = zip(function (all, deaths, recovered, uci) {
+                    return all - deaths - recovered - uci;
+                }, s.all, s.deaths, s.recovered, s.uci);
+                var stacked = zip(function (r, rec, d, u) {
+                    return r + rec + d + u;
+                }, remaining, s.recovered, s.deaths, s.uci);
+                var pct = function (values) {
+                    return zip(function (v, total) {
+                        return finite(v / total * 100);
+                    }, values, stacked);
+                };
+                var index = x.map(function (_, i) {
+                    return i;
+                });
+                var doubling = function (days) {
+                    return index.map(function (i) {
+                        return Math.pow(2, i / days);
+                    });
+                };
+                var dashed = {'dash': 'dash', 'width': 1};
+                var axes = function (y_title) {
+                    return {'yaxis': {'title': y_title}, 'xaxis': {'title': 'Date'}};
+                };
+                var bars = function (values, title, y_title, color) {
+                    var trace = {'type': 'bar', 'x': x, 'y': values};
+                    if (color) {
+                        trace.marker = {'color': color};
+                    }
+                    return {'data': [trace], 'layout': Object.assign({'title': title + ' [' + ca + ']'}, axes(y_title))};
+                };
+
+                return [
+                    {
+                        'data': [
+                            {'x': x, 'y': s.all, 'name': 'Confirmed cases'},
+                            {'x': x, 'y': index.map(function (i) {
+                                return s.a * Math.exp(-s.b * i);
+                            }), 'name': 'Exponential model', 'line': dashed},
+                            {'x': x, 'y': zip(function (r, u) {
+                                return r + u;
+                            }, remaining, s.uci), 'name': 'Active cases'},
+                        ],
+                        'layout': Object.assign({
+                            'title': 'All cases with exponential model calculated 5days ago [' + ca + '] ', 'height': 800
+                        }, axes('Number of cases')),
+                    },
+                    {
+                        'data': [
+                            {'x': x, 'y': pct(remaining), 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Other Confirmed',
+                             'line': {'color': 'darkorange'}},
+                            {'x': x, 'y': pct(s.recovered), 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Recovered',
+                             'line': {'color': 'forestgreen'}},
+                            {'x': x, 'y': pct(s.uci), 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Icus',
+                             'line': {'color': 'crimson'}},
+                            {'x': x, 'y': pct(s.deaths), 'stackgroup': 'one', 'hoverinfo': 'x+y', 'name': 'Deaths',
+                             'line': {'color': 'black'}},
+                        ],
+                        'layout': {
+                            'title': '% Distribution of the cases across phases [' + ca + ']',
+                            'yaxis': {'range': [0, 100], 'title': 'Stacked percentage of cases'},
+                            'xaxis': {'title': 'Date'},
+                        },
+                    },
+                    {
+                        'data': [
+                            {'type': 'bar', 'x': x, 'y': remaining, 'name': 'Other confirmed',
+                             'marker': {'color': 'darkorange'}},
+                            {'type': 'bar', 'x': x, 'y': s.uci, 'name': 'Cases in ICU', 'marker': {'color': 'crimson'}},
+                            {'type': 'bar', 'x': x, 'y': s.recovered, 'name': 'Recovered',
+                             'marker': {'color': 'forestgreen'}},
+                            {'type': 'bar', 'x': x, 'y': s.deaths, 'name': 'Deaths', 'marker': {'color': 'black'}},
+                        ],
+                        'layout': Object.assign({'title': 'Daily cases distribution [' + ca + ']', 'barmode': 'stack'},
+                            axes('Number of cases')),
+                    },
+                    bars(diff(s.all), 'Daily new contagious', 'Daily cases'),
+                    bars(pctChange(s.all), '% increase of new cases', '% change'),
+                    bars(diff(s.uci), 'Daily new cases in ICU', 'Daily cases', 'crimson'),
+                    bars(pctChange(s.uci), '% increase of ICU', '% change', 'crimson'),
+                    bars(diff(s.recovered), 'Daily new recovered cases', 'Daily cases', 'forestgreen'),
+                    bars(pctChange(s.recovered), '% increase of recovered', '% change', 'forestgreen'),
+                    bars(diff(s.deaths), 'Daily deaths', 'Daily cases', 'black'),
+                    bars(pctChange(s.deaths), '% increase of deaths', '% change', 'black'),
+                    {
+                        'data': [
+                            {'x': x, 'y': s.all, 'name': 'All cases'},
+                            {'x': x, 'y': doubling(1), 'name': 'Doubling cases every day', 'line': dashed},
+                            {'x': x, 'y': doubling(2), 'name': 'Doubling cases every 2 days', 'line': dashed},
+                            {'x': x, 'y': doubling(3), 'name': 'Doubling cases every 3 days', 'line': dashed},
+                            {'x': x, 'y': doubling(4), 'name': 'Doubling cases every 4 days', 'line': dashed},
+                        ],
+                        'layout': {
+                            'title': 'Exponential growth overview (log scale) [' + ca + ']',
+                            'yaxis': {'type': 'log', 'autorange': true, 'title': 'Number of cases'},
+                            'xaxis': {'title': 'Date'},
+                            'height': 800,
+                        },
+                    },
+                    {
+                        'data': [{'x': s.all, 'y': rolling(diff(s.all), 3), 'name': 'All cases'}],
+                        'layout': {
+                            'title': 'Trajectory of confirmed cases (log scale) [' + ca + ']',
+                            'yaxis': {'type': 'log', 'autorange': true, 'title': 'New confirmed cases'},
+                            'xaxis': {'type': 'log', 'autorange': true, 'title': 'Total confirmed cases'},
+                            'height': 800,
+                        },
+                    },
+                ];
+            },
+        },
+    });
+
+    // Regions are kept per country, the page path tells which one is shown.
+    function seriesKey(ca, pathname) {
+        return (pathname || '/') + '|' + ca;
+    }
+
+    // The series of a region if it comes from the dataset the server currently serves.
+    function current(store, ca, pathname, version) {
+        var s = store && store[seriesKey(ca, pathname)];
+        return s && s.dataset === version ? s : null;
+    }
+
+    function dates(s) {
+        if (s.dates) {
+            return s.dates;
+        }
+        var start = new Date(s.start + 'Z').getTime();
+        return s.all.map(function (_, i) {
+            return new Date(start + i * 86400000).toISOString().slice(0, 19);
+        });
+    }
+
+    // A missing value (null, a province has no deaths, ICU or recovered series) makes the result missing, instead of
+    // counting as 0.
+    function zip(fn) {
+        var columns = Array.prototype.slice.call(arguments, 1);
+        return columns[0].map(function (_, i) {
+            var values = columns.map(function (column) {
+                return column[i];
+            });
+            return values.some(missing) ? null : fn.apply(null, values);
+        });
+    }
+
+    function missing(value) {
+        return value === null || value === undefined;
+    }
+
+    function finite(value) {
+        return isFinite(value) ? value : null;
+    }
+
+    function diff(values) {
+        return values.map(function (v, i) {
+            return i === 0 || missing(v) || missing(values[i - 1]) ? null : v - values[i - 1];
+        });
+    }
+
+    function pctChange(values) {
+        return values.map(function (v, i) {
+            return i === 0 || missing(v) || missing(values[i - 1]) ? null : finite(100 * (v / values[i - 1] - 1));
+        });
+    }
+
+    function rolling(values, window) {
+        return values.map(function (_, i) {
+            if (i < window - 1) {
+                return null;
+            }
+            var sum = 0;
+            for (var j = i - window + 1; j <= i; j++) {
+                if (values[j] === null) {
+                    return null;
+                }
+                sum += values[j];
+            }
+            return sum / window;
+        });
+    }
+})();
@@ -0,0 +1,82 @@
+import argparse
+import io
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from data import DataIt, read_it_regions  # noqa: E402
+from fixtures import IT_REGIONS, synthetic_feed  # noqa: E402
+
+
+def legacy_build(df):
+    # DataIt.build_data before it was vectorized, kept to compare timings and output.
+    df = df.copy()
+    df['data'] = pd.to_datetime(df['data'])
+    df['date'] = df['data']
+    df.set_index(['data', 'codice_regione'], inplace=True)
+    df_cases = pd.DataFrame()
+    df_deaths = pd.DataFrame()
+    df_uci = pd.DataFrame()
+    df_recovered = pd.DataFrame()
+    df_tests = pd.DataFrame()
+    for region in df['denominazione_regione'].unique():
+        df_cases[region] = df[df['denominazione_regione'] == region].set_index('date')['totale_casi']
+        df_deaths[region] = df[df['denominazione_regione'] == region].set_index('date')['deceduti']
+        df_uci[region] = df[df['denominazione_regione'] == region].set_index('date')['terapia_intensiva']
+        df_recovered[region] = df[df['denominazione_regione'] == region].set_index('date')['dimessi_guariti']
+        df_tests[region] = df[df['denominazione_regione'] == region].set_index('date')['tamponi']
+    for df_metric in (df_cases, df_deaths, df_uci, df_recovered, df_tests):
+        df_metric['Total'] = df_metric.sum(axis=1)
+    return df_cases, df_uci, df_deaths, df_recovered, df_tests
+
+
+def vectorized_build(df):
+    metrics = DataIt()._pivot_metrics(df)
+    return (metrics['totale_casi'], metrics['terapia_intensiva'], metrics['deceduti'], metrics['dimessi_guariti'],
+            metrics['tamponi'])
+
+
+def legacy(csv):
+    return legacy_build(pd.read_csv(io.StringIO(csv)))
+
+
+def vectorized(csv):
+    return vectorized_build(read_it_regions(io.StringIO(csv)))
+
+
+def timed(fn, csv, repeat):
+    # Parse and reshape together: each reshape expects the frame its own parse gives.
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(csv)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the legacy and vectorized DataIt.build_data, parse and reshape.')
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--regions', type=int, default=len(IT_REGIONS))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    csv = synthetic_feed(args.years, args.regions).to_csv(index=False)
+    legacy_time, legacy_frames = timed(legacy, csv, args.repeat)
+    vectorized_time, vectorized_frames = timed(vectorized, csv, args.repeat)
+    for expected, actual in zip(legacy_frames, vectorized_frames):
+        # The reshape always gives floats, NaN marking a date missing for a region, the loop integers when none is.
+        pd.testing.assert_frame_equal(expected.astype('float64'), actual)
+
+    print(f'{len(csv.splitlines()) - 1} rows, {args.regions} regions, {args.years} years')
+    print(f'legacy loop: {legacy_time * 1000:.1f} ms')
+    print(f'vectorized:  {vectorized_time * 1000:.1f} ms ({legacy_time / vectorized_time:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import gc
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from data import CSV_ENGINE, read_it_regions  # noqa: E402
+from fixtures import IT_REGIONS, synthetic_feed  # noqa: E402
+
+
+def legacy_parse(f):
+    # The parse before read_it_regions: every column inferred, then every row's timestamp parsed.
+    df = pd.read_csv(f)
+    df['date'] = pd.to_datetime(df['data'])
+    return df
+
+
+def measure(parse, csv, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        df = parse(io.BytesIO(csv))
+        best = min(best, time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    parse(io.BytesIO(csv))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, df.memory_usage(deep=True).sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the inferred and the typed parse of the Italian feed.')
+    parser.add_argument('--years', type=float, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--regions', type=int, default=len(IT_REGIONS))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'engine: {CSV_ENGINE}')
+    print(f'{"rows":>8} {"":8} {"time":>10} {"peak":>12} {"frame":>12}')
+    for years in args.years:
+        # The upstream file grows by one row per region every day.
+        csv = synthetic_feed(years, args.regions).to_csv(index=False).encode('utf-8')
+        rows = csv.count(b'\n') - 1
+        for name, parse in (('legacy', legacy_parse), ('typed', read_it_regions)):
+            elapsed, peak, size = measure(parse, csv, args.repeat)
+            print(f'{rows:8} {name:8} {elapsed * 1000:7.1f} ms {peak / 2 ** 20:8.1f} MiB {size / 2 ** 20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fixtures import serve, write_fixtures  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Response bytes of fig_overview and fig_comparator per encoding.')
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--country', default='IT', choices=['ES', 'IT'])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    write_fixtures(os.path.join(directory, 'upstream'), args.years)
+    server, base_url = serve(os.path.join(directory, 'upstream'))
+    os.environ.update(COUNTRY=args.country, DATA_ES_URL=f'{base_url}/es', DATA_IT_URL=f'{base_url}/it',
+                      STORE_DIR=os.path.join(directory, 'store'), CACHE_DIR=os.path.join(directory, 'cache'))
+
+    import dash_core_components as dcc
+    from plotly.utils import PlotlyJSONEncoder
+
+    import app
+    from components import build_figure_grid
+    from encoding import encode_figure
+
+    regions = [region for region in app.data.get_ccaa() if region != 'Total']
+    grids = {
+        'fig_overview': app.overview_grid(app.data, 'Total'),
+        'fig_comparator': app.comparator_grid(app.data, regions[:5]),
+    }
+    for name, grid in grids.items():
+        sizes = {}
+        for encoding in ('plain', 'json', 'bdata'):
+            figures = [[graph.figure if encoding == 'plain' else encode_figure(graph.figure, encoding)
+                        for graph in row] for row in grid]
+            children = build_figure_grid([[dcc.Graph(figure=figure) for figure in row] for row in figures])
+            sizes[encoding] = len(json.dumps(children, cls=PlotlyJSONEncoder).encode('utf-8'))
+        print(f'{name}: ' + ', '.join(
+            f'{encoding} {size / 1024:.0f} KiB ({size / sizes["plain"]:.0%})' for encoding, size in sizes.items()))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import functools
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+IT_REGIONS = ['Abruzzo', 'Basilicata', 'P.A. Bolzano', 'Calabria', 'Campania', 'Emilia-Romagna',
+              'Friuli Venezia Giulia', 'Lazio', 'Liguria', 'Lombardia', 'Marche', 'Molise', 'Piemonte', 'Puglia',
+              'Sardegna', 'Sicilia', 'Toscana', 'P.A. Trento', 'Umbria', "Valle d'Aosta", 'Veneto']
+ES_REGIONS = ['Andalucía', 'Aragón', 'Asturias', 'Baleares', 'Canarias', 'Cantabria', 'Castilla La Mancha',
+              'Castilla y León', 'Cataluña', 'Ceuta', 'C. Valenciana', 'Extremadura', 'Galicia', 'Madrid', 'Melilla',
+              'Murcia', 'Navarra', 'País Vasco', 'La Rioja']
+ES_FILES = {'casos': 100, 'uci': 5, 'fallecidos': 10, 'altas': 80}
+
+
+def region_names(names, regions):
+    return [names[i] if i < len(names) else f'Region {i}' for i in range(regions)]
+
+
+def feed_dates(years, ending_today=False):
+    # Served fixtures end today, so that DataIt finds the daily files it asks for after the last stored date.
+    periods = int(365 * years)
+    if ending_today:
+        return pd.date_range(end=pd.Timestamp.today().normalize() + pd.Timedelta(hours=18), periods=periods, freq='D')
+    return pd.date_range('2020-02-24T18:00:00', periods=periods, freq='D')
+
+
+def synthetic_feed(years, regions=len(IT_REGIONS), seed=0, ending_today=False):
+    # The Italian regional feed: one row per date and region.
+    rng = np.random.default_rng(seed)
+    dates = feed_dates(years, ending_today)
+    names = region_names(IT_REGIONS, regions)
+    rows = len(dates) * len(names)
+
+    def cumulative(high):
+        return np.cumsum(rng.integers(0, high, (len(dates), len(names))), axis=0).ravel()
+
+    return pd.DataFrame({
+        'data': np.repeat(dates.strftime('%Y-%m-%dT%H:%M:%S'), len(names)),
+        'stato': 'ITA',
+        'codice_regione': np.tile(np.arange(len(names)), len(dates)),
+        'denominazione_regione': np.tile(names, len(dates)),
+        'lat': 41.0,
+        'long': 12.0,
+        'ricoverati_con_sintomi': rng.integers(0, 1000, rows),
+        'terapia_intensiva': rng.integers(0, 200, rows),
+        'totale_positivi': rng.integers(0, 5000, rows),
+        'dimessi_guariti': cumulative(80),
+        'deceduti': cumulative(10),
+        'totale_casi': cumulative(100),
+        'tamponi': cumulative(1000),
+        'note': '',
+    })
+
+
+def synthetic_provinces(feed, provinces=5, seed=0):
+    # The Italian province feed matching `feed`: the confirmed cases of each region split between its provinces, with
+    # the cases not yet assigned to one under 'In fase di definizione/aggiornamento' like upstream.
+    rng = np.random.default_rng(seed)
+    regions = feed['denominazione_regione'].unique()
+    weights = rng.random((len(regions), provinces))
+    weights *= 0.95 / weights.sum(axis=1, keepdims=True)
+    cases = feed['totale_casi'].to_numpy()
+    region_index = np.tile(np.arange(len(regions)), len(feed) // len(regions))
+    assigned = np.floor(cases[:, None] * weights[region_index]).astype(int)
+    names = [f'Provincia {i + 1}' for i in range(provinces)] + ['In fase di definizione/aggiornamento']
+    counts = np.column_stack([assigned, cases - assigned.sum(axis=1)])
+    return pd.DataFrame({
+        'data': np.repeat(feed['data'].to_numpy(), len(names)),
+        'stato': 'ITA',
+        'codice_regione': np.repeat(feed['codice_regione'].to_numpy(), len(names)),
+        'denominazione_regione': np.repeat(feed['denominazione_regione'].to_numpy(), len(names)),
+        'codice_provincia': np.tile(np.arange(len(names)), len(feed)),
+        'denominazione_provincia': np.tile(names, len(feed)),
+        'sigla_provincia': '',
+        'lat': 41.0,
+        'long': 12.0,
+        'totale_casi': counts.ravel(),
+        'note': '',
+    })
+
+
+def synthetic_es_files(years, regions=len(ES_REGIONS), seed=0, ending_today=False):
+    # The four datadista files: one row per region plus Total, one column per date.
+    rng = np.random.default_rng(seed)
+    dates = feed_dates(years, ending_today).normalize()
+    names = region_names(ES_REGIONS, regions)
+    files = {}
+    for name, high in ES_FILES.items():
+        values = np.cumsum(rng.integers(0, high, (len(names), len(dates))), axis=1)
+        df = pd.DataFrame(np.vstack([values, values.sum(axis=0)]), columns=dates.strftime('%Y-%m-%d'))
+        df.insert(0, 'CCAA', names + ['Total'])
+        df.insert(0, 'cod_ine', [f'{i + 1:02d}' for i in range(len(names))] + [''])
+        files[f'ccaa_covid19_{name}.csv'] = df
+    return files
+
+
+def write_fixtures(directory, years, regions=None, seed=0, provinces=5):
+    # Lays the files out like upstream: DATA_ES_URL=<base>/es and DATA_IT_URL=<base>/it.
+    es_dir = os.path.join(directory, 'es')
+    os.makedirs(es_dir, exist_ok=True)
+    for name, df in synthetic_es_files(years, regions or len(ES_REGIONS), seed, ending_today=True).items():
+        df.to_csv(os.path.join(es_dir, name), index=False)
+
+    feed = synthetic_feed(years, regions or len(IT_REGIONS), seed, ending_today=True)
+    feeds = {'regioni': feed}
+    if provinces:
+        feeds['province'] = synthetic_provinces(feed, provinces, seed)
+    for name, df in feeds.items():
+        it_dir = os.path.join(directory, 'it', f'dati-{name}')
+        os.makedirs(it_dir, exist_ok=True)
+        df.to_csv(os.path.join(it_dir, f'dpc-covid19-ita-{name}.csv'), index=False)
+        for day, df_day in df.groupby(df['data'].str[:10]):
+            df_day.to_csv(os.path.join(it_dir, f'dpc-covid19-ita-{name}-{day.replace("-", "")}.csv'), index=False)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory, port=0):
+    # Local stand-in for raw.githubusercontent.com, answering If-Modified-Since with 304 like upstream.
+    server = ThreadingHTTPServer(('127.0.0.1', port), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
@@ -0,0 +1,478 @@
+import argparse
+import http.client
+import importlib.util
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from fixtures import serve, write_fixtures  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# --worker-class name: gunicorn worker class.
+WORKER_CLASSES = {'sync': 'sync', 'threaded': 'gthread', 'gevent': 'gevent'}
+# The inputs a visitor changes, every server callback they trigger is replayed.
+TRIGGERS = ('selector', 'comporator-selector')
+SCENARIOS = ('cold', 'hot', 'mixed', 'storm')
+# Props the layout leaves unset but the browser sends, the pathname is set per country.
+DEFAULT_VALUES = {('table-data', 'page_current'): 0, ('table-data', 'sort_by'): [], ('table-data', 'filter_query'): ''}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, q):
+    # Nearest rank, values sorted.
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+class Client:
+    # One keep-alive connection per virtual user, reopened when a sync worker closes it after every response.
+
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The worker closed an idle connection between two requests: once more on a new one.
+            self.connection.close()
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        content = response.read()
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+        return response.status, content
+
+    def close(self):
+        self.connection.close()
+
+
+def layout_values(node, values):
+    # The initial props of every component with an id, as the browser would send them.
+    if isinstance(node, list):
+        for child in node:
+            layout_values(child, values)
+    elif isinstance(node, dict):
+        props = node.get('props', {})
+        if isinstance(props.get('id'), str):
+            for prop, value in props.items():
+                values[(props['id'], prop)] = value
+        layout_values(props.get('children'), values)
+    return values
+
+
+def triggered_callbacks(dependencies, trigger):
+    # The server callbacks fired when the value of `trigger` changes. Clientside and pattern-matching callbacks make no
+    # request or are not fired by the selectors.
+    callbacks = []
+    for dependency in dependencies:
+        if dependency.get('clientside_function') or '{' in dependency['output']:
+            continue
+        if any(item['id'] == trigger and item['property'] == 'value' for item in dependency['inputs']):
+            name = dependency['output'].strip('.').split('.')[0]
+            callbacks.append((name, dependency))
+    return callbacks
+
+
+def callback_body(dependency, values, trigger):
+    def items(specs):
+        return [{'id': spec['id'], 'property': spec['property'], 'value': values.get((spec['id'], spec['property']))}
+                for spec in specs]
+
+    return json.dumps({
+        'output': dependency['output'],
+        'inputs': items(dependency['inputs']),
+        'state': items(dependency.get('state', [])),
+        'changedPropIds': [f'{trigger}.value'],
+    })
+
+
+class Workload:
+    # What the virtual users pick: `hot_ratio` of the regions come from a few popular ones, the others from every
+    # region. The comparator gets `compare` regions at a time.
+
+    def __init__(self, regions, hot, hot_ratio, comparator_share, compare, seed):
+        self.regions = regions
+        self.hot = hot
+        self.hot_ratio = hot_ratio
+        self.comparator_share = comparator_share
+        self.compare = compare
+        self.random = random.Random(seed)
+        self.cold = None
+        self.lock = threading.Lock()
+
+    def walk_every_region(self):
+        # Every region once in a random order, each of them a miss on the worker it lands on.
+        self.cold = list(self.regions)
+        self.random.shuffle(self.cold)
+
+    def next_action(self):
+        with self.lock:
+            if self.cold is not None:
+                if not self.cold:
+                    return None
+                trigger = 'comporator-selector' if self.random.random() < self.comparator_share else 'selector'
+                if trigger == 'selector':
+                    return trigger, self.cold.pop()
+                picked = [self.cold.pop() for _ in range(min(self.compare, len(self.cold)))]
+                return trigger, picked
+            pool = self.hot if self.random.random() < self.hot_ratio else self.regions
+            if self.random.random() < self.comparator_share:
+                # Sorted, so the popular comparisons repeat.
+                return 'comporator-selector', sorted(self.random.sample(pool, min(self.compare, len(pool))))
+            return 'selector', self.random.choice(pool)
+
+
+class MemorySampler(threading.Thread):
+    # Peak resident memory of the gunicorn workers. The preloaded dataset is shared copy-on-write, so RSS counts it in
+    # every worker while PSS splits it between them: the PSS sum is what the workers cost together.
+
+    def __init__(self, master, interval=0.5):
+        super().__init__(daemon=True)
+        self.master = master
+        self.interval = interval
+        self.peak = {'workers_rss_mib': 0, 'workers_pss_mib': 0, 'max_worker_rss_mib': 0}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        usage = [process_memory(pid) for pid in worker_pids(self.master)]
+        usage = [memory for memory in usage if memory is not None]
+        if usage:
+            for name, value in (('workers_rss_mib', sum(rss for rss, _ in usage)),
+                                ('workers_pss_mib', sum(pss for _, pss in usage)),
+                                ('max_worker_rss_mib', max(rss for rss, _ in usage))):
+                self.peak[name] = max(self.peak[name], value)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+        return {name: round(value, 1) for name, value in self.peak.items()}
+
+
+def worker_pids(master):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command may contain spaces, the fields after it do not.
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == master:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def process_memory(pid):
+    # (RSS, PSS) in MiB from /proc, PSS falls back to RSS on kernels without smaps_rollup.
+    fields = {}
+    for path in (f'/proc/{pid}/smaps_rollup', f'/proc/{pid}/status'):
+        try:
+            with open(path) as f:
+                for line in f:
+                    name, _, value = line.partition(':')
+                    if name in ('Rss', 'Pss', 'VmRSS'):
+                        fields[name] = int(value.split()[0]) / 1024
+        except OSError:
+            continue
+        if fields:
+            break
+    rss = fields.get('Rss', fields.get('VmRSS'))
+    return None if rss is None else (rss, fields.get('Pss', rss))
+
+
+def start_server(args, worker_class, workers, env, log_path):
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', 'app:server', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--worker-class', WORKER_CLASSES[worker_class], '--timeout', '120']
+    if worker_class == 'threaded':
+        command += ['--threads', str(args.threads)]
+    elif worker_class == 'gevent':
+        command += ['--worker-connections', str(args.users * 2)]
+    # From the repository, so gunicorn.conf.py preloads the data in the master like in production.
+    log = open(log_path, 'w')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            status, _ = Client(port).request('GET', '/_dash-layout')
+            if status == 200:
+                return process, port
+        except OSError:
+            pass
+        time.sleep(0.5)
+    stop_server(process)
+    with open(log_path) as f:
+        sys.stderr.write(f.read()[-4000:])
+    raise RuntimeError(f'gunicorn ({worker_class}, {workers} workers) did not start, log in {log_path}')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def replay(port, workload, callbacks, values, users, duration, think):
+    # `users` visitors, each sending the requests of one action after the other, until the duration is over or the
+    # workload has no action left. Returns the latency of every request per callback and the errors.
+    samples = {name: [] for trigger in callbacks.values() for name, _ in trigger}
+    errors = {name: 0 for name in samples}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def user():
+        client = Client(port)
+        while time.time() < deadline:
+            action = workload.next_action()
+            if action is None:
+                break
+            trigger, value = action
+            user_values = dict(values)
+            user_values[(trigger, 'value')] = value
+            for name, dependency in callbacks[trigger]:
+                body = callback_body(dependency, user_values, trigger)
+                start = time.perf_counter()
+                try:
+                    status, _ = client.request('POST', '/_dash-update-component', body)
+                except (http.client.HTTPException, OSError):
+                    status = None
+                elapsed = time.perf_counter() - start
+                with lock:
+                    samples[name].append(elapsed)
+                    # 204 is a PreventUpdate.
+                    if status not in (200, 204):
+                        errors[name] += 1
+            if think:
+                time.sleep(think)
+        client.close()
+
+    start = time.time()
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, time.time() - start
+
+
+def summarize(samples, errors, elapsed):
+    callbacks = {}
+    for name, latencies in samples.items():
+        latencies = sorted(latencies)
+        callbacks[name] = {
+            'requests': len(latencies),
+            'errors': errors[name],
+            **{f'p{q}_ms': round(percentile(latencies, q) * 1000, 2) if latencies else None for q in (50, 95, 99)},
+        }
+    every = sorted(latency for latencies in samples.values() for latency in latencies)
+    return {
+        'requests': len(every),
+        'errors': sum(errors.values()),
+        'seconds': round(elapsed, 2),
+        'throughput_rps': round(len(every) / elapsed, 1) if elapsed else None,
+        **{f'p{q}_ms': round(percentile(every, q) * 1000, 2) if every else None for q in (50, 95, 99)},
+        'callbacks': callbacks,
+    }
+
+
+def new_dataset(upstream, args, seed):
+    # Revises every series upstream, each file replaced at once so the data server never serves a partial one.
+    staging = tempfile.mkdtemp()
+    write_fixtures(staging, args.years, args.regions, seed=seed)
+    for directory, _, files in os.walk(staging):
+        for name in files:
+            source = os.path.join(directory, name)
+            target = os.path.join(upstream, os.path.relpath(source, staging))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+    shutil.rmtree(staging)
+
+
+def run_server(args, worker_class, workers, env, upstream, directory):
+    log_path = os.path.join(directory, f'gunicorn-{worker_class}-{workers}.log')
+    process, port = start_server(args, worker_class, workers, env, log_path)
+    sampler = MemorySampler(process.pid)
+    sampler.start()
+    try:
+        client = Client(port)
+        path = f'/{args.country.lower()}'
+        values = layout_values(json.loads(client.request('GET', '/_dash-layout')[1]), dict(DEFAULT_VALUES))
+        values[('url', 'pathname')] = path
+        regions = json.loads(client.request('GET', f'/api/{args.country}/regions')[1])['regions']
+        dependencies = json.loads(client.request('GET', '/_dash-dependencies')[1])
+        client.close()
+        callbacks = {trigger: triggered_callbacks(dependencies, trigger) for trigger in TRIGGERS}
+        hot = regions[:args.hot]
+
+        results = {}
+        for scenario in args.scenarios:
+            hot_ratio = {'hot': 1, 'cold': 0}.get(scenario, args.hot_ratio)
+            workload = Workload(regions, hot, hot_ratio, args.comparator_share, args.comparison_size,
+                                args.seed)
+            duration = args.duration
+            if scenario == 'cold':
+                workload.walk_every_region()
+            elif scenario == 'storm':
+                # A new dataset version makes every cached figure stale at once, in each worker when its next
+                # background refresh lands. The run lasts long enough for all of them to refresh.
+                new_dataset(upstream, args, args.seed + 1)
+                duration += args.data_max_age * 0.75
+            results[scenario] = summarize(*replay(port, workload, callbacks, values, args.users, duration,
+                                                  args.think_ms / 1000))
+            print_scenario(scenario, results[scenario])
+    finally:
+        memory = sampler.stop()
+        stop_server(process)
+    print(f'  workers RSS {memory["workers_rss_mib"]:.1f} MiB, PSS {memory["workers_pss_mib"]:.1f} MiB, '
+          f'largest worker {memory["max_worker_rss_mib"]:.1f} MiB')
+    return {'worker_class': worker_class, 'workers': workers, 'memory': memory, 'scenarios': results}
+
+
+def format_ms(value):
+    return f'{value:9.1f}' if value is not None else f'{"-":>9}'
+
+
+def print_scenario(scenario, result):
+    print(f'  {scenario:8} {result["throughput_rps"]:8.1f} req/s {result["requests"]:7} requests '
+          f'{result["errors"]:5} errors   p50 {format_ms(result["p50_ms"])}   p95 {format_ms(result["p95_ms"])}   '
+          f'p99 {format_ms(result["p99_ms"])} ms')
+    for name, callback in result['callbacks'].items():
+        print(f'    {name:24} {callback["requests"]:7} requests {callback["errors"]:5} errors   '
+              f'p50 {format_ms(callback["p50_ms"])}   p95 {format_ms(callback["p95_ms"])}   '
+              f'p99 {format_ms(callback["p99_ms"])} ms')
+
+
+def print_summary(runs, scenarios):
+    print(f'\n{"":20}' + ''.join(f'{scenario:>24}' for scenario in scenarios) + f'{"PSS":>12}')
+    print(f'{"":20}' + f'{"req/s":>12}{"p95 ms":>12}' * len(scenarios) + f'{"MiB":>12}')
+    for run in runs:
+        row = f'{run["worker_class"] + " x" + str(run["workers"]):20}'
+        for scenario in scenarios:
+            result = run['scenarios'].get(scenario)
+            row += f'{result["throughput_rps"]:12.1f}{format_ms(result["p95_ms"]):>12}' if result else ' ' * 24
+        print(row + f'{run["memory"]["workers_pss_mib"]:12.1f}')
+
+
+def run(args):
+    classes = []
+    for worker_class in args.worker_class:
+        if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print('Skipping the gevent workers, gevent is not installed')
+            continue
+        classes.append(worker_class)
+
+    directory = tempfile.mkdtemp()
+    upstream = os.path.join(directory, 'upstream')
+    os.makedirs(upstream)
+    data_server, base_url = serve(upstream)
+
+    runs = []
+    for worker_class in classes:
+        for workers in args.workers:
+            # Every configuration starts from an empty store, caches and upstream revision.
+            write_fixtures(upstream, args.years, args.regions, seed=args.seed)
+            run_directory = tempfile.mkdtemp(dir=directory)
+            env = dict(os.environ, COUNTRY=args.country, DATA_ES_URL=f'{base_url}/es', DATA_IT_URL=f'{base_url}/it',
+                       DATA_MAX_AGE=str(args.data_max_age), STORE_DIR=os.path.join(run_directory, 'store'),
+                       CACHE_DIR=os.path.join(run_directory, 'cache'))
+            print(f'{worker_class} x{workers}' + (f' ({args.threads} threads)' if worker_class == 'threaded' else ''))
+            runs.append(run_server(args, worker_class, workers, env, upstream, directory))
+    data_server.shutdown()
+    print_summary(runs, args.scenarios)
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                            cwd=ROOT).stdout.strip()
+    report = {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {name: getattr(args, name) for name in ('country', 'years', 'regions', 'users', 'duration', 'hot',
+                                                           'hot_ratio', 'comparator_share', 'data_max_age', 'threads')},
+        'cache_backend': os.getenv('CACHE_BACKEND', 'memory'),
+        'runs': runs,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'load-{commit or "worktree"}-{args.country}-{args.users}u.json')
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved {path}')
+
+
+def compare(base_path, head_path):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+    before = {(run['worker_class'], run['workers'], scenario): result
+              for run in base['runs'] for scenario, result in run['scenarios'].items()}
+    print(f'{"":30} {base["commit"]:>21} {head["commit"]:>21}')
+    print(f'{"":30} {"req/s":>10} {"p95 ms":>10} {"req/s":>10} {"p95 ms":>10}')
+    for run in head['runs']:
+        for scenario, result in run['scenarios'].items():
+            name = f'{run["worker_class"]} x{run["workers"]} {scenario}'
+            old = before.get((run['worker_class'], run['workers'], scenario))
+            old_columns = f'{old["throughput_rps"]:10.1f} {format_ms(old["p95_ms"]):>10}' if old else f'{"-":>21}'
+            print(f'{name:30} {old_columns} {result["throughput_rps"]:10.1f} {format_ms(result["p95_ms"]):>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay Dash callback traffic against gunicorn and a local data server.')
+    parser.add_argument('--country', default='IT', choices=['ES', 'IT'])
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--regions', type=int, default=21)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--worker-class', nargs='+', default=['sync', 'threaded'], choices=list(WORKER_CLASSES))
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker of the threaded class')
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per scenario')
+    parser.add_argument('--think-ms', type=float, default=0, help='pause of a user between two actions')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--hot', type=int, default=3, help='number of popular regions')
+    parser.add_argument('--hot-ratio', type=float, default=0.8, help='share of the mixed traffic on popular regions')
+    parser.add_argument('--comparator-share', type=float, default=0.25, help='share of actions on the comparator')
+    parser.add_argument('--comparison-size', type=int, default=5, help='regions per comparison')
+    parser.add_argument('--data-max-age', type=int, default=20, help='DATA_MAX_AGE of the server, in seconds')
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='compare two saved result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
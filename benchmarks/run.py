@@ -0,0 +1,170 @@
+import argparse
+import gc
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fixtures import serve, write_fixtures  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def measure(fn, setup, repeat, payload):
+    # Times are taken without tracemalloc, which slows the code down, the peak memory in one extra traced run.
+    times = []
+    result = None
+    for _ in range(repeat):
+        setup()
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    setup()
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'time_ms': statistics.median(times) * 1000,
+        'min_ms': min(times) * 1000,
+        'peak_kib': peak / 1024,
+        'payload_bytes': payload_size(result) if payload else None,
+    }
+
+
+def payload_size(result):
+    from plotly.utils import PlotlyJSONEncoder
+
+    if result is None:
+        return None
+    try:
+        return len(json.dumps(result, cls=PlotlyJSONEncoder).encode('utf-8'))
+    except TypeError:
+        return None
+
+
+def benchmarks(country, upstream):
+    import app
+    import data as data_module
+    from cache import MemoryCache
+    from store import Store
+
+    data = data_module.getData(country)
+    es_file = open(os.path.join(upstream, 'es', 'ccaa_covid19_casos.csv'), 'rb').read()
+    regions = [region for region in data.get_ccaa() if region != 'Total']
+
+    def nothing():
+        pass
+
+    def cold_build():
+        # A first start: empty store and no ETag / Last-Modified to revalidate against.
+        data.store = Store(tempfile.mkdtemp())
+        data._stored = {}
+        data_module.fetcher.clear()
+
+    def cold_derived():
+        data._cubes = []
+        data.derived_cache = MemoryCache(max_age_seconds=24 * 60 * 60)
+
+    def cold_figures():
+        data.figure_cache = MemoryCache(max_age_seconds=24 * 60 * 60)
+
+    def cold_callback():
+        cold_derived()
+        cold_figures()
+
+    # name: (function, setup run before each call, whether the result is a callback response to measure)
+    path = f'/{country.lower()}'
+    return {
+        'DataEs._normalize_data': (lambda: data_module.DataEs()._normalize_data(io.BytesIO(es_file)), nothing, False),
+        f'{type(data).__name__}.build_data': (data.build_data, cold_build, False),
+        'Data.cube': (data.cube, cold_derived, False),
+        'Data.data_ccaa': (lambda: [data.data_ccaa(region) for region in regions], nothing, False),
+        'Data.exp_fits': (data.exp_fits, cold_derived, False),
+        'fig_overview (cold)': (lambda: app.fig_overview('Total', path), cold_callback, True),
+        'fig_overview (cached)': (lambda: app.fig_overview('Total', path), nothing, True),
+        'fig_comparator (cold)': (lambda: app.fig_comparator(regions[:5], 0, [], path), cold_callback, True),
+        'fig_comparator (all, aligned)': (
+            lambda: app.fig_comparator(regions, 100, ['per_capita'], path), cold_callback, True),
+        'table (cold)': (lambda: app.table('Total', 0, app.TABLE_PAGE_SIZE, [], '', path), cold_callback, True),
+    }
+
+
+def run(args):
+    directory = tempfile.mkdtemp()
+    upstream = os.path.join(directory, 'upstream')
+    write_fixtures(upstream, args.years, args.regions)
+    server, base_url = serve(upstream)
+    os.environ.update(DATA_ES_URL=f'{base_url}/es', DATA_IT_URL=f'{base_url}/it',
+                      STORE_DIR=os.path.join(directory, 'store'), CACHE_DIR=os.path.join(directory, 'cache'))
+
+    results = {}
+    for name, (fn, setup, payload) in benchmarks(args.country, upstream).items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(fn, setup, args.repeat, payload)
+        print(format_row(name, results[name]))
+    server.shutdown()
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    report = {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {'country': args.country, 'years': args.years, 'regions': args.regions, 'repeat': args.repeat},
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{commit or "worktree"}-{args.country}-{args.regions}x{args.years}y.json')
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved {path}')
+
+
+def format_row(name, result):
+    payload = f'{result["payload_bytes"] / 1024:9.1f} KiB' if result['payload_bytes'] is not None else ' ' * 13
+    return f'{name:28} {result["time_ms"]:10.2f} ms {result["peak_kib"]:12.1f} KiB peak {payload}'
+
+
+def compare(base_path, head_path):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+    print(f'{"":28} {base["commit"]:>12} {head["commit"]:>12}')
+    for name, result in head['results'].items():
+        before = base['results'].get(name)
+        if before is None:
+            print(f'{name:28} {"-":>12} {result["time_ms"]:10.2f}ms')
+            continue
+        ratio = result['time_ms'] / before['time_ms'] if before['time_ms'] else float('nan')
+        print(f'{name:28} {before["time_ms"]:10.2f}ms {result["time_ms"]:10.2f}ms {ratio:6.2f}x '
+              f'{before["peak_kib"]:10.0f}KiB {result["peak_kib"]:10.0f}KiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the data and callback hot paths.')
+    parser.add_argument('--country', default='IT', choices=['ES', 'IT'])
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--regions', type=int, default=21)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help='run the benchmarks whose name contains this text')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='compare two saved result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from metrics import Gauge, cache_evictions, cache_requests, key_family, registry
+
+_missing = object()
+
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_MB', 256)) * 2 ** 20
+
+
+def sizeof(value):
+    # Bytes held by a cached value, measured on the numpy and pandas buffers and walking into containers. An array
+    # view counts the memory it spans, so a broadcast array counts its base once.
+    if isinstance(value, np.ndarray):
+        low, high = np.byte_bounds(value)
+        return high - low
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class Budget:
+    # One byte budget over the memory caches sharing it. Once they hold more than max_bytes together, the least
+    # recently used entry of the key family holding the most bytes, in any of them, is dropped, so that one kind of
+    # entry cannot flush all the others. Pinned keys are never dropped to make room. The caches share its lock.
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.caches = weakref.WeakSet()
+        self.guard = threading.RLock()
+
+    def bytes(self):
+        return sum(cache.bytes for cache in list(self.caches))
+
+    def evict(self):
+        with self.guard:
+            if self.bytes() <= self.max_bytes:
+                return
+            caches = list(self.caches)
+            for cache in caches:
+                cache._expire()
+            while self.bytes() > self.max_bytes:
+                sizes = [(size, cache, family) for cache in caches for family, size in cache._evictable().items()]
+                size, cache, family = max(sizes, key=lambda entry: entry[0], default=(0, None, None))
+                if size <= 0:
+                    break
+                cache._evict(family)
+
+
+class MemoryCache:
+    # Entries expire after max_age_seconds. The bytes they hold count against `budget`, shared with other caches or
+    # one of max_bytes of its own.
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_age_seconds=120, namespace='', budget=None):
+        self.namespace = namespace
+        self.budget = budget or Budget(max_bytes)
+        self.budget.caches.add(self)
+        self.max_age_seconds = max_age_seconds
+        self.bytes = 0
+        self._families = {}
+        self._family_bytes = {}
+        self._pinned = set()
+        self._stats = {}
+        self._locks = {}
+        self._guard = self.budget.guard
+        _caches.add(self)
+
+    def _count(self, family, stat, amount=1):
+        stats = self._stats.setdefault(family, {'hits': 0, 'misses': 0, 'evictions': 0})
+        stats[stat] += amount
+
+    def _get(self, key):
+        family = key_family(key)
+        with self._guard:
+            entry = self._families.get(family, {}).get(key)
+            if entry is None:
+                return family, _missing
+            if time.time() - entry[2] > self.max_age_seconds:
+                self._remove(family, key)
+                return family, _missing
+            self._families[family].move_to_end(key)
+            return family, entry[0]
+
+    def get(self, key, default=None):
+        family, value = self._get(key)
+        with self._guard:
+            self._count(family, 'misses' if value is _missing else 'hits')
+        cache_requests.inc(cache=self.namespace, family=family, result='miss' if value is _missing else 'hit')
+        return default if value is _missing else value
+
+    def __getitem__(self, key):
+        value = self._get(key)[1]
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        family = key_family(key)
+        size = sizeof(value)
+        with self._guard:
+            entries = self._families.setdefault(family, OrderedDict())
+            if key in entries:
+                self._remove(family, key)
+            entries[key] = (value, size, time.time())
+            self._family_bytes[family] = self._family_bytes.get(family, 0) + size
+            self.bytes += size
+        self.budget.evict()
+
+    def __contains__(self, key):
+        return self._get(key)[1] is not _missing
+
+    def _remove(self, family, key):
+        value, size, stored_at = self._families[family].pop(key)
+        self._family_bytes[family] -= size
+        self.bytes -= size
+
+    def _expire(self):
+        now = time.time()
+        for family, entries in self._families.items():
+            for key in [key for key, entry in entries.items() if now - entry[2] > self.max_age_seconds]:
+                self._remove(family, key)
+
+    def _evictable(self):
+        # Bytes of every key family that can be dropped to make room.
+        sizes = dict(self._family_bytes)
+        for key in self._pinned:
+            entry = self._families.get(key_family(key), {}).get(key)
+            if entry is not None:
+                sizes[key_family(key)] -= entry[1]
+        return sizes
+
+    def _evict(self, family):
+        key = next(key for key in self._families[family] if key not in self._pinned)
+        self._remove(family, key)
+        self._count(family, 'evictions')
+        cache_evictions.inc(cache=self.namespace, family=family)
+
+    def pin(self, key):
+        self._pinned.add(key)
+
+    def stats(self):
+        # Entries, bytes, hits, misses and evictions of every key family.
+        with self._guard:
+            return {family: dict(self._stats.get(family, {'hits': 0, 'misses': 0, 'evictions': 0}),
+                                 entries=len(self._families.get(family, ())),
+                                 bytes=self._family_bytes.get(family, 0))
+                    for family in set(self._families) | set(self._stats)}
+
+    @contextmanager
+    def lock(self, key):
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            yield
+
+
+_caches = weakref.WeakSet()
+
+registry.register(Gauge(
+    'cache_bytes', 'Bytes held by the in-memory caches, by cache and key family.',
+    lambda: [({'cache': cache.namespace, 'family': family}, stats['bytes'])
+             for cache in list(_caches) for family, stats in cache.stats().items()]))
+
+
+# A file cache entry: a header with the length of the pickle and the offset and length of every buffer, the pickle,
+# then the buffers aligned for numpy. With pickle protocol 5 the numpy arrays, so the pandas columns, are written as
+# such out of the pickle and read back as views of the memory mapped file: every worker of the host shares the page
+# cache copy instead of unpickling its own. Before Python 3.8 everything goes in the pickle.
+ENTRY_MAGIC = b'CCH1'
+ENTRY_HEADER = struct.Struct('<4sQI')
+ENTRY_BUFFER = struct.Struct('<QQ')
+ENTRY_ALIGNMENT = 64
+OUT_OF_BAND = pickle.HIGHEST_PROTOCOL >= 5
+
+
+def aligned(offset):
+    return -(-offset // ENTRY_ALIGNMENT) * ENTRY_ALIGNMENT
+
+
+def dump_entry(value, f):
+    buffers = []
+    if OUT_OF_BAND:
+        payload = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    else:
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    views = [buffer.raw() for buffer in buffers]
+    offset = aligned(ENTRY_HEADER.size + ENTRY_BUFFER.size * len(views) + len(payload))
+    table = []
+    for view in views:
+        table.append((offset, view.nbytes))
+        offset = aligned(offset + view.nbytes)
+    f.write(ENTRY_HEADER.pack(ENTRY_MAGIC, len(payload), len(views)))
+    for entry in table:
+        f.write(ENTRY_BUFFER.pack(*entry))
+    f.write(payload)
+    for (start, _), view in zip(table, views):
+        f.write(b'\0' * (start - f.tell()))
+        f.write(view)
+
+
+def load_entry(f):
+    # The arrays keep the mapping alive, and stay valid after the file is replaced or evicted.
+    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, length, count = ENTRY_HEADER.unpack_from(mapped)
+    if magic != ENTRY_MAGIC:
+        raise pickle.UnpicklingError('not a cache entry')
+    table = [ENTRY_BUFFER.unpack_from(mapped, ENTRY_HEADER.size + ENTRY_BUFFER.size * i) for i in range(count)]
+    start = ENTRY_HEADER.size + ENTRY_BUFFER.size * count
+    view = memoryview(mapped)
+    if not count:
+        return pickle.loads(view[start:start + length])
+    return pickle.loads(view[start:start + length], buffers=[view[offset:offset + size] for offset, size in table])
+
+
+class FileCache:
+    # Entries are written once per host into `directory` and shared by every worker process, their arrays memory
+    # mapped. Each process keeps the values of the max_len entries it used last and only reloads one when the file on
+    # disk has been replaced. A value is forgotten once its file expires, is evicted or goes missing.
+
+    def __init__(self, directory, max_len=100, max_age_seconds=120, namespace=''):
+        self.namespace = namespace
+        self.directory = directory
+        self.max_len = max_len
+        self.max_age_seconds = max_age_seconds
+        # key: (mtime, value), least recently used first.
+        self._loaded = OrderedDict()
+        self._loaded_guard = threading.Lock()
+        self._pinned = set()
+        self._memory = MemoryCache(max_age_seconds=max_age_seconds)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        # The key family leads the file name, for the eviction counts.
+        return os.path.join(self.directory, f"{key_family(key)}-{hashlib.sha1(key.encode('utf-8')).hexdigest()}.pkl")
+
+    def get(self, key, default=None):
+        value = self._get(key)
+        cache_requests.inc(cache=self.namespace, family=key_family(key), result='miss' if value is _missing else 'hit')
+        return default if value is _missing else value
+
+    def _get(self, key):
+        path = self._path(key)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._forget(key)
+            return _missing
+        if time.time() - mtime / 1e9 > self.max_age_seconds:
+            self._forget(key)
+            return _missing
+
+        with self._loaded_guard:
+            loaded = self._loaded.get(key)
+            if loaded is not None and loaded[0] == mtime:
+                self._loaded.move_to_end(key)
+                return loaded[1]
+        self._forget(key)
+        try:
+            with open(path, 'rb') as f:
+                value = load_entry(f)
+        except (FileNotFoundError, EOFError, ValueError, struct.error, pickle.UnpicklingError):
+            return _missing
+        self._remember(key, mtime, value)
+        return value
+
+    def _remember(self, key, mtime, value):
+        with self._loaded_guard:
+            self._loaded[key] = (mtime, value)
+            self._loaded.move_to_end(key)
+            while len(self._loaded) > self.max_len:
+                self._loaded.popitem(last=False)
+
+    def _forget(self, key):
+        with self._loaded_guard:
+            self._loaded.pop(key, None)
+
+    def __getitem__(self, key):
+        value = self._get(key)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                dump_entry(value, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        # The value written is not kept: loading the file again maps its arrays instead of holding a private copy.
+        self._forget(key)
+        self._evict()
+
+    def _evict(self):
+        # Keeps at most max_len entries on disk, dropping the least recently written ones that are not pinned.
+        entries = [entry for entry in os.scandir(self.directory)
+                   if entry.name.endswith('.pkl') and entry.path not in self._pinned]
+        if len(entries) <= self.max_len:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        evicted = set()
+        for entry in entries[:len(entries) - self.max_len]:
+            try:
+                os.unlink(entry.path)
+                cache_evictions.inc(cache=self.namespace, family=entry.name.split('-', 1)[0])
+            except FileNotFoundError:
+                pass
+            evicted.add(entry.path)
+        with self._loaded_guard:
+            for key in [key for key in self._loaded if self._path(key) in evicted]:
+                del self._loaded[key]
+
+    def __contains__(self, key):
+        return self._get(key) is not _missing
+
+    def pin(self, key):
+        self._pinned.add(self._path(key))
+
+    @contextmanager
+    def lock(self, key):
+        # The thread lock serialises callers inside this worker, the flock serialises the workers on this host.
+        with self._memory.lock(key):
+            with open(self._path(key) + '.lock', 'w') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+CACHE_BACKENDS = {
+    'memory': lambda namespace, max_len, max_age_seconds, budget: MemoryCache(
+        max_age_seconds=max_age_seconds, namespace=namespace, budget=budget),
+    'file': lambda namespace, max_len, max_age_seconds, budget: FileCache(
+        os.path.join(os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'covid-19')), namespace),
+        max_len=max_len, max_age_seconds=max_age_seconds, namespace=namespace),
+}
+
+
+def build_cache(namespace, max_len=100, max_age_seconds=120, budget=None):
+    # max_len bounds the file backend, the memory backend is bounded by `budget`, CACHE_MAX_MB of its own by default.
+    return CACHE_BACKENDS[os.getenv('CACHE_BACKEND', 'memory')](namespace, max_len, max_age_seconds, budget)
@@ -1,9 +1,11 @@
+import json
+
 import dash_core_components as dcc
 import dash_html_components as html
 
-from data import getData
-
-data = getData()
+from data import getData, hierarchy_order, node_label
+from encoding import encode_figure
+from profiling import stage
 
 
 def build_figure_grid(layout_grid):
@@ -12,24 +14,90 @@ def build_figure_grid(layout_grid):
             for row in layout_grid]
 
 
-def selector():
-    ccaa = data.get_ccaa()
+def cached_figures(cache, key, build):
+    # The figures of a grid are stored serialized, so a repeated view skips the pandas work and the encoding of the
+    # series, and the file cache backend can share them between workers.
+    payload = cache.get(key)
+    if payload is None:
+        with stage('figures'):
+            grid = build()
+        with stage('encode'):
+            payload = json.dumps([[encode_figure(graph.figure) for graph in row] for row in grid])
+        cache[key] = payload
+    with stage('decode'):
+        return json.loads(payload)
+
+
+def cached_figure_grid(cache, key, build, ids=None):
+    figures = cached_figures(cache, key, build)
+    if ids is None:
+        return build_figure_grid([[dcc.Graph(figure=figure) for figure in row] for row in figures])
+    return build_figure_grid([[dcc.Graph(id=graph_id, figure=figure) for graph_id, figure in zip(id_row, row)]
+                              for id_row, row in zip(ids, figures)])
+
+
+def overview_placeholders(layout_grid):
+    # Empty graphs the client side callbacks fill, laid out like the server rendered overview.
+    return build_figure_grid([[dcc.Graph(id=f'overview-{name}') for name in row] for row in layout_grid])
+
+
+def country_links(countries):
+    return html.Div(className='tabs', children=[
+        html.Ul(children=[html.Li(children=[dcc.Link(getData(x).dash_title(), href=f'/{x.lower()}')])
+                          for x in countries])
+    ])
+
+
+def selector_options(data):
+    ccaa = hierarchy_order(data.regions())
+    return [{'label': node_label(x), 'value': x} for x in ccaa]
+
+
+def comparator_options(data):
+    ccaa = hierarchy_order(data.regions())
+    return [{'label': node_label(x), 'value': x} for x in filter(lambda i: i != 'Total', ccaa)]
+
+
+def selector(data):
     return dcc.Dropdown(
         id='selector',
-        options=[{'label': x, 'value': x} for x in ccaa],
+        options=selector_options(data),
         value='Total'
     )
 
 
-def comparator_selector():
-    ccaa = data.get_ccaa()
+def comparator_selector(data):
     return dcc.Dropdown(
         id='comporator-selector',
-        options=[{'label': x, 'value': x} for x in filter(lambda i: i != 'Total', ccaa)],
+        options=comparator_options(data),
         multi=True,
     )
 
 
+def comparator_controls():
+    return html.Div(className='columns', children=[
+        html.Div(className='column', children=[
+            dcc.RadioItems(
+                id='comparator-align',
+                options=[
+                    {'label': 'Calendar date', 'value': 0},
+                    {'label': 'Days since the 100th case', 'value': 100},
+                    {'label': 'Days since the 1000th case', 'value': 1000},
+                ],
+                value=0,
+                labelStyle={'display': 'inline-block', 'margin-right': '1em'},
+            ),
+        ]),
+        html.Div(className='column', children=[
+            dcc.Checklist(
+                id='comparator-scale',
+                options=[{'label': 'Per 100k inhabitants', 'value': 'per_capita'}],
+                value=[],
+            ),
+        ]),
+    ])
+
+
 def box(color, value, text):
     return html.Div(className=f'column is-3', children=[
         html.Div(className=f'notification {color}', children=[
@@ -1,15 +1,250 @@
+import hashlib
+import json
 import os
+from collections import namedtuple
 
 import dash_html_components as html
 import numpy as np
 import pandas as pd
-from expiringdict import ExpiringDict
 from scipy.optimize import curve_fit
 
-cache = ExpiringDict(max_len=100, max_age_seconds=120)
+from cache import Budget, build_cache
+from encoding import encode_values
+from fetch import Fetcher
+from metrics import Gauge, registry
+from profiling import stage
+from refresh import Refresher
+from store import build_store, merge_frames
+
+# The pyarrow CSV engine needs pandas 1.4, older releases raise on it.
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow' if tuple(int(part) for part in pd.__version__.split('.')[:2]) >= (1, 4) else 'c'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+fetcher = Fetcher()
+
+# Seconds a downloaded dataset is served for, it is refreshed in the background after three quarters of it.
+DATA_MAX_AGE = int(os.getenv('DATA_MAX_AGE', 120))
+
+MANIFEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifests')
+
+CUBE_METRICS = ['all', 'deaths', 'uci', 'recovered', 'remaining', 'stacked_sum', 'remaining_pct', 'recovered_pct',
+                'deaths_pct', 'uci_pct']
+
+Cube = namedtuple('Cube', ['regions', 'dates', 'values', 'version', 'region_versions'])
+
+
+def build_cube(df_cases, df_uci, df_deaths, df_recovered, df_provinces=None):
+    # Every derived column of every node in one nodes x dates x CUBE_METRICS array, so a node frame is a view. The
+    # nodes are the regions and the country 'Total', followed by the provinces when there are any, which only have
+    # confirmed cases: their other columns are NaN.
+    regions = df_cases.columns
+    dates = df_cases.index.union(df_deaths.index).union(df_uci.index).union(df_recovered.index)
+    if df_provinces is not None:
+        dates = dates.union(df_provinces.index)
+        regions = regions.append(df_provinces.columns)
+    values = np.empty((len(regions), len(dates), len(CUBE_METRICS)))
+    count = len(df_cases.columns)
+    for i, df in enumerate([df_cases, df_deaths, df_uci, df_recovered]):
+        frame = df.reindex(index=dates, columns=regions[:count]).fillna(method='ffill').fillna(0)
+        values[:count, :, i] = frame.to_numpy().T
+    if df_provinces is not None:
+        values[count:, :, 0] = df_provinces.reindex(index=dates).fillna(method='ffill').fillna(0).to_numpy().T
+        values[count:, :, 1:4] = np.nan
+
+    # Content hashes of the source columns: derived results are keyed by them instead of expiring on a timer.
+    dates_key = dates.asi8.tobytes()
+    region_versions = {region: hashlib.sha1(dates_key + values[i, :, :4].tobytes()).hexdigest()
+                       for i, region in enumerate(regions)}
+    version = hashlib.sha1(''.join(f'{k}{v}' for k, v in region_versions.items()).encode('utf-8')).hexdigest()
+
+    all_cases, deaths, uci, recovered = (values[:, :, i] for i in range(4))
+    remaining, stacked_sum = values[:, :, 4], values[:, :, 5]
+    np.subtract(all_cases, deaths + recovered + uci, out=remaining)
+    np.add(remaining + recovered, deaths + uci, out=stacked_sum)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, column in enumerate([remaining, recovered, deaths, uci], start=6):
+            np.multiply(column / stacked_sum, 100, out=values[:, :, i])
+    return Cube(regions, dates, values, version, region_versions)
+
+
+# A province is the node '<region>/<province>' below its region, the regions are below the country node 'Total'.
+NODE_SEPARATOR = '/'
+
+
+def hierarchy_order(nodes):
+    # Every region followed by its provinces.
+    children = {}
+    for node in nodes:
+        region, separator, province = node.partition(NODE_SEPARATOR)
+        if separator:
+            children.setdefault(region, []).append(node)
+    return [child for node in nodes if NODE_SEPARATOR not in node for child in [node] + children.get(node, [])]
+
+
+def node_label(node):
+    region, separator, province = node.partition(NODE_SEPARATOR)
+    return f'{province} ({region})' if separator else node
+
+
+ExpFits = namedtuple('ExpFits', ['params', 'curves'])
+
+
+def fit_exponential(x, y):
+    # Closed form fit of y = a * exp(-b * x) for every row of y at once: least squares on log(y) weighted by y^2, which
+    # approximates the least squares on y that curve_fit minimises. Rows that cannot be fitted this way are flagged.
+    positive = y > 0
+    weights = np.where(positive, y / np.where(positive, y, 1).max(axis=1, keepdims=True), 0) ** 2
+    log_y = np.log(np.where(positive, y, 1))
+    sw = weights.sum(axis=1)
+    swx = weights @ x
+    swxx = weights @ (x * x)
+    swl = (weights * log_y).sum(axis=1)
+    swxl = (weights * log_y) @ x
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        denominator = sw * swxx - swx ** 2
+        slope = (sw * swxl - swx * swl) / denominator
+        a = np.exp((swl - slope * swx) / sw)
+        b = -slope
+    failed = (positive.sum(axis=1) < 2) | ~(denominator > 0) | ~np.isfinite(a) | ~np.isfinite(b)
+    return a, b, failed
+
+
+# Root mean square error of the closed form fit, relative to the largest value of the row, past which curve_fit refines
+# it. A purely exponential curve stays well below, a curve bending away from the exponential (every region past its
+# first weeks) does not, and its closed form fit would be far from the least squares one.
+EXP_FIT_TOLERANCE = 0.01
+
+
+def fit_error(x, y, a, b):
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        residuals = a[:, None] * np.exp(-b[:, None] * x) - y
+        return np.sqrt(np.mean(residuals ** 2, axis=1)) / np.abs(y).max(axis=1)
+
+
+DerivedMetric = namedtuple('DerivedMetric', ['name', 'depends', 'compute'])
+# Series derived from the cube, declared once with the metrics they are computed from. Each takes and returns regions x
+# dates arrays, so one call covers every region.
+DERIVED_METRICS = {}
+
+
+def derived_metric(name, *depends):
+    def register(compute):
+        DERIVED_METRICS[name] = DerivedMetric(name, depends, compute)
+        return compute
+    return register
+
+
+def shifted_difference(values, periods=1):
+    result = np.full_like(values, np.nan)
+    result[:, periods:] = values[:, periods:] - values[:, :-periods]
+    return result
+
+
+def rolling_mean(values, window):
+    # NaN while the window is not full or holds a NaN, like pandas' rolling(window).mean().
+    result = np.full_like(values, np.nan)
+    cumsum = np.cumsum(np.nan_to_num(values), axis=1)
+    nans = np.cumsum(np.isnan(values), axis=1)
+    total = cumsum[:, window - 1:] - np.pad(cumsum, ((0, 0), (1, 0)))[:, :-window]
+    missing = nans[:, window - 1:] - np.pad(nans, ((0, 0), (1, 0)))[:, :-window]
+    result[:, window - 1:] = np.where(missing == 0, total / window, np.nan)
+    return result
+
+
+def pct_change(values):
+    result = np.full_like(values, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result[:, 1:] = 100 * (values[:, 1:] / values[:, :-1] - 1)
+    return result
+
+
+for column in ['all', 'uci', 'recovered', 'deaths']:
+    derived_metric(f'{column}_delta', column)(shifted_difference)
+    derived_metric(f'{column}_pct_change', column)(pct_change)
+derived_metric('all_delta_avg3', 'all_delta')(lambda all_delta: rolling_mean(all_delta, 3))
+
+
+@derived_metric('active', 'remaining', 'uci')
+def active(remaining, uci):
+    return remaining + uci
+
+
+@derived_metric('growth_rate', 'all')
+def growth_rate(all_cases):
+    # Daily growth in % of the confirmed cases, averaged over the last week.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_growth = shifted_difference(np.log(np.where(all_cases > 0, all_cases, np.nan)), 7) / 7
+    return 100 * np.expm1(log_growth)
+
+
+@derived_metric('doubling_time', 'growth_rate')
+def doubling_time(growth):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(growth > 0, np.log(2) / np.log1p(growth / 100), np.nan)
+
+
+def doubling_curve(days):
+    # Reference curves of cases doubling every `days` days, the same for every region. After a few years they overflow
+    # to inf, which the charts show as a gap.
+    def compute(all_cases):
+        with np.errstate(over='ignore'):
+            return np.broadcast_to(np.power(2, np.arange(all_cases.shape[1]) / days), all_cases.shape)
+    return compute
+
+
+for days in range(1, 5):
+    derived_metric(f'doubling_every_{days}_days', 'all')(doubling_curve(days))
+
+
+Comparison = namedtuple('Comparison', ['regions', 'x', 'series'])
+COMPARISON_SERIES = ['all', 'recovered', 'deaths', 'all_delta_avg3', 'all_pct_change']
+# Counts that scale with the population, the rest are ratios.
+PER_CAPITA_SERIES = ['all', 'recovered', 'deaths', 'all_delta_avg3']
+
+
+def compare_series(series, cases, population=None, align_cases=None):
+    # series are regions x dates arrays of the compared regions. They are scaled per 100k inhabitants when `population`
+    # is given, and shifted so that day 0 is the first day with `align_cases` cases when that is given, regions that
+    # never get there left empty.
+    if population is not None:
+        series = {column: serie / population[:, None] * 1e5 if column in PER_CAPITA_SERIES else serie
+                  for column, serie in series.items()}
+    if not align_cases:
+        return None, series
+    reached = cases >= align_cases
+    start = np.where(reached.any(axis=1), reached.argmax(axis=1), cases.shape[1])
+    days = max(1, cases.shape[1] - start.min())
+    columns = start[:, None] + np.arange(days)
+    inside = columns < cases.shape[1]
+    columns = np.minimum(columns, cases.shape[1] - 1)
+    aligned = {column: np.where(inside, np.take_along_axis(serie, columns, axis=1), np.nan)
+               for column, serie in series.items()}
+    return np.arange(days), aligned
 
 
 class Data:
+    country = None
+
+    def __init__(self):
+        # Every country has its own cache namespaces, store and refresh schedule, so several can share one process.
+        # Its in-memory caches share one CACHE_MAX_MB budget.
+        budget = Budget()
+        self.cache = build_cache(self.country, max_age_seconds=DATA_MAX_AGE, budget=budget)
+        self.derived_cache = build_cache(f'{self.country}-derived', max_age_seconds=24 * 60 * 60, budget=budget)
+        self.figure_cache = build_cache(f'{self.country}-figures', max_age_seconds=24 * 60 * 60, budget=budget)
+        self.store = build_store(self.country)
+        self.refresher = Refresher('data', self.build_data, self.cache, max_age_seconds=DATA_MAX_AGE,
+                                   on_load=self._on_refresh)
+        # Everything else is derived from the base dataset, making room for derived entries never drops it.
+        self.cache.pin(self.refresher.key)
+        # (snapshot, cube) of the last two snapshots derived, newest last: callbacks still hold the published snapshot
+        # while the refresh thread derives the next one.
+        self._cubes = []
+        self._population = None
+        self._stored = {}
 
     def build_data(self):
         pass
@@ -21,67 +256,203 @@ class Data:
         pass
 
     def all_data(self):
-        if cache.get('data') is None:
-            cache['data'] = self.build_data()
-        return cache['data']
+        return self.refresher.get()
+
+    def stored(self, name):
+        if self._stored.get(name) is None:
+            self._stored[name] = self.store.load(name)
+        return self._stored[name]
+
+    def update_stored(self, name, delta):
+        stored = self.stored(name)
+        merged = delta if stored is None else merge_frames(stored, delta, name)
+        if merged is not stored:
+            self.store.save(name, merged)
+            self._stored[name] = merged
+        return merged
+
+    def data_age(self):
+        return self.refresher.age()
+
+    def cube(self):
+        return self._derive(self.all_data())
+
+    def _derive(self, data):
+        # Derived once per dataset: rebuilt only when all_data() hands out a different snapshot, and kept as it is when
+        # the new snapshot has the same content.
+        cubes = self._cubes
+        for built_data, cube in cubes:
+            if built_data is data:
+                return cube
+        with stage('cube'):
+            cube = build_cube(*data)
+        if cubes and cubes[-1][1].version == cube.version:
+            cube = cubes[-1][1]
+        elif list(cube.regions) != self.manifest():
+            self.store.save_json('manifest', list(cube.regions))
+        self._cubes = cubes[-1:] + [(data, cube)]
+        return cube
+
+    def _on_refresh(self, data):
+        # Runs in the refresh thread before the new dataset is served, so callbacks find it derived and fitted.
+        self.exp_fits(self._derive(data))
+
+    def warm(self):
+        # Loads the data without starting the refresh thread, for a gunicorn master preloading the app before forking.
+        # The fits are given the cube, going through cube() would schedule the refresh.
+        self.exp_fits(self._derive(self.refresher.get(schedule=False)))
+        # Nor leave the download threads running in a process about to fork.
+        fetcher.shutdown()
+
+    def manifest(self):
+        # Region names saved by the last build, or the list shipped with the app before the first one.
+        regions = self.store.load_json('manifest')
+        if regions is None:
+            with open(os.path.join(MANIFEST_DIR, f'{self.country}.json')) as f:
+                regions = json.load(f)
+        return regions
+
+    def regions(self):
+        # For the selectors: never triggers a download, the manifest stands in until data has been loaded.
+        if self._cubes:
+            return list(self._cubes[-1][1].regions)
+        return self.manifest()
+
+    def dataset_version(self):
+        return self.cube().version
 
     def get_ccaa(self):
-        df_cases, df_uci, df_deaths, df_recovered = self.all_data()
-        return df_cases.columns
+        return self.cube().regions
 
     def data_ccaa(self, ca):
-        if cache.get(f'data{ca}') is None:
-            df_cases, df_uci, df_deaths, df_recovered = self.all_data()
-            data = pd.concat([df_cases[ca], df_deaths[ca], df_uci[ca], df_recovered[ca]], axis='columns').fillna(
-                method='ffill').fillna(0)
-            data.columns = ["all", "deaths", "uci", "recovered"]
-            data['remaining'] = data["all"] - data["deaths"] - data["recovered"] - data["uci"]
-            data['stacked_sum'] = data[['remaining', 'recovered', 'deaths', 'uci']].sum(axis=1)
-            data['remaining_pct'] = (data['remaining'] / data['stacked_sum']) * 100
-            data['recovered_pct'] = (data['recovered'] / data['stacked_sum']) * 100
-            data['deaths_pct'] = (data['deaths'] / data['stacked_sum']) * 100
-            data['uci_pct'] = (data['uci'] / data['stacked_sum']) * 100
-            cache[f'data{ca}'] = data
-        return cache[f'data{ca}']
-
-    def lin_space(self):
-        df_cases, df_uci, df_deaths, df_recovered = self.all_data()
-        x = np.linspace(0, df_cases.shape[0] - 1, df_cases.shape[0])
+        cube = self.cube()
+        with stage('data_ccaa'):
+            return pd.DataFrame(cube.values[cube.regions.get_loc(ca)], index=cube.dates, columns=CUBE_METRICS)
+
+    def metric(self, name, ca=None):
+        # A cube column or a derived metric, of every region or of `ca`. A derived metric is computed from its
+        # dependencies the first time any chart asks for it, then reused until the dataset changes.
+        cube = self.cube()
+        if name in CUBE_METRICS:
+            values = cube.values[:, :, CUBE_METRICS.index(name)]
+        else:
+            key = f'metric:{name}:{cube.version}'
+            values = self.derived_cache.get(key)
+            if values is None:
+                with stage('metrics'):
+                    metric = DERIVED_METRICS[name]
+                    values = metric.compute(*(self.metric(dependency) for dependency in metric.depends))
+                self.derived_cache[key] = values
+        return values if ca is None else values[cube.regions.get_loc(ca)]
+
+    def lin_space(self, cube=None):
+        dates = (cube or self.cube()).dates
+        x = np.linspace(0, len(dates) - 1, len(dates))
         return x
 
     def data_exp(self):
-        x = self.lin_space()
-        return np.power(2, x), np.power(2, x / 2), np.power(2, x / 3), np.power(2, x / 4)
+        return tuple(self.metric(f'doubling_every_{days}_days', 'Total') for days in range(1, 5))
 
     def exponential_func(self, x, a, b):
         return a * np.exp(-b * x)
 
-    def exp_fit(self, y, ca):
-        if cache.get(f'exp{ca}') is None:
-            x = self.lin_space()
-            popt, pcov = curve_fit(self.exponential_func, x[:-5], y[:-5], p0=(1, 1e-6))
-            cache[f'exp{ca}'] = self.exponential_func(x, *popt)
-
-        return cache[f'exp{ca}']
+    def exp_fits(self, cube=None):
+        # Every region fitted at once per dataset version, on the data up to 5 days ago. curve_fit only runs for the
+        # regions the closed form cannot fit, or fits poorly, starting from the closed form. Its result is reused
+        # while that region's data does not change.
+        cube = cube or self.cube()
+        key = f'exp:{cube.version}'
+        fits = self.derived_cache.get(key)
+        if fits is None:
+            with stage('exp_fit'):
+                x = self.lin_space(cube)
+                y = cube.values[:, :-5, CUBE_METRICS.index('all')]
+                a, b, failed = fit_exponential(x[:-5], y)
+                refine = failed | ~(fit_error(x[:-5], y, a, b) <= EXP_FIT_TOLERANCE)
+                for i in np.flatnonzero(refine):
+                    ca = cube.regions[i]
+                    region_key = f'exp{ca}:{cube.region_versions[ca]}'
+                    popt = self.derived_cache.get(region_key)
+                    if popt is None:
+                        p0 = (1, 1e-6) if failed[i] else (a[i], b[i])
+                        try:
+                            popt, pcov = curve_fit(self.exponential_func, x[:-5], y[i], p0=p0)
+                        except (RuntimeError, ValueError, TypeError):
+                            popt = (np.nan, np.nan)
+                        self.derived_cache[region_key] = popt
+                    a[i], b[i] = popt
+
+                with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                    params = pd.DataFrame({
+                        'a': a,
+                        'b': b,
+                        'doubling_time': np.where(b < 0, np.log(2) / -b, np.nan),
+                    }, index=cube.regions)
+                    fits = ExpFits(params, self.exponential_func(x, a[:, None], b[:, None]))
+            self.derived_cache[key] = fits
+        return fits
+
+    def exp_fit(self, ca):
+        fits = self.exp_fits()
+        return fits.curves[fits.params.index.get_loc(ca)]
+
+    def raw_series(self, ca):
+        # What the client side mode ships once per region: the cumulative counts as integers, the dates as a start when
+        # they are one day apart, and the exponential model as its two parameters.
+        cube = self.cube()
+        i = cube.regions.get_loc(ca)
+        a, b = self.exp_fits().params.loc[ca, ['a', 'b']]
+        series = {
+            'region': ca,
+            'version': cube.region_versions[ca],
+            'start': cube.dates[0].isoformat(),
+            'a': float(a) if np.isfinite(a) else None,
+            'b': float(b) if np.isfinite(b) else None,
+        }
+        if not (np.diff(cube.dates.normalize().asi8) == pd.Timedelta(days=1).value).all():
+            series['dates'] = [date.isoformat() for date in cube.dates]
+        for column in ['all', 'deaths', 'uci', 'recovered']:
+            series[column] = encode_values(cube.values[i, :, CUBE_METRICS.index(column)], 'json')
+        return series
+
+    def doubling_time(self, ca):
+        return self.exp_fits().params.loc[ca, 'doubling_time']
+
+    def population(self):
+        if self._population is None:
+            with open(os.path.join(MANIFEST_DIR, f'population-{self.country}.json')) as f:
+                self._population = pd.Series(json.load(f), dtype='float64')
+        return self._population
+
+    def compare(self, regions, align_cases=None, per_capita=False):
+        # A selection made before a refresh can name a region the dataset no longer has, it is left out: indexing with
+        # its -1 would draw the last region under its name.
+        cube = self.cube()
+        index = cube.regions.get_indexer(regions)
+        regions = [ca for ca, i in zip(regions, index) if i >= 0]
+        index = index[index >= 0]
+        series = {column: self.metric(column)[index] for column in COMPARISON_SERIES}
+        population = self.population().reindex(regions).to_numpy() if per_capita else None
+        with stage('compare'):
+            x, series = compare_series(series, self.metric('all')[index], population, align_cases)
+        return Comparison(list(regions), cube.dates if x is None else x, series)
 
 
 class DataEs(Data):
+    country = 'ES'
+    base_url = os.getenv('DATA_ES_URL', 'https://raw.githubusercontent.com/datadista/datasets/master/COVID%2019')
 
-    def _normalize_data(self, dataset_url):
-        df = pd.read_csv(dataset_url)
+    def _normalize_data(self, dataset):
+        df = pd.read_csv(dataset)
         df_ca = df.set_index('CCAA').drop(['cod_ine'], axis='columns').transpose()
         df_ca.index = pd.to_datetime(df_ca.index, format='%Y/%m/%d')
         return df_ca.reindex(pd.date_range(df_ca.index[0], df_ca.index[-1]))
 
     def build_data(self):
-        df_cases = self._normalize_data(
-            'https://raw.githubusercontent.com/datadista/datasets/master/COVID%2019/ccaa_covid19_casos.csv')
-        df_uci = self._normalize_data(
-            'https://raw.githubusercontent.com/datadista/datasets/master/COVID%2019/ccaa_covid19_uci.csv')
-        df_deaths = self._normalize_data(
-            'https://raw.githubusercontent.com/datadista/datasets/master/COVID%2019/ccaa_covid19_fallecidos.csv')
-        df_recovered = self._normalize_data(
-            'https://raw.githubusercontent.com/datadista/datasets/master/COVID%2019/ccaa_covid19_altas.csv')
+        # The files are wide (one column per date), so a changed file is parsed whole and only merged into the store.
+        names = ['casos', 'uci', 'fallecidos', 'altas']
+        frames = fetcher.fetch_all([f'{self.base_url}/ccaa_covid19_{name}.csv' for name in names], self._normalize_data)
+        df_cases, df_uci, df_deaths, df_recovered = (self.update_stored(n, f) for n, f in zip(names, frames))
 
         return df_cases, df_uci, df_deaths, df_recovered
 
@@ -101,41 +472,92 @@ class DataEs(Data):
         ])
 
 
+IT_METRICS = ['totale_casi', 'deceduti', 'terapia_intensiva', 'dimessi_guariti', 'tamponi']
+# The only columns read from the regional and province files, the repeated strings as categories.
+# Floats like the inferred parse: a blank cell upstream is read as NaN instead of failing the whole file, and the
+# counts stay exact up to 2 ** 53.
+IT_COLUMNS = {'data': 'category', 'denominazione_regione': 'category', **{metric: 'float64' for metric in IT_METRICS}}
+IT_PROVINCE_COLUMNS = {'data': 'category', 'denominazione_regione': 'category', 'denominazione_provincia': 'category',
+                       'totale_casi': 'float64'}
+# Daily files re-read on every refresh on top of the new ones, so that upstream corrections get patched in the store.
+IT_RECHECK_DAYS = 7
+# Past this many missing days one download of the full history is cheaper than the daily files.
+IT_RESEED_DAYS = 30
+
+
+def read_it_feed(f, columns):
+    # Each distinct timestamp is parsed once, not once per row.
+    df = pd.read_csv(f, usecols=list(columns), dtype=columns, engine=CSV_ENGINE)
+    dates = pd.DatetimeIndex(pd.to_datetime(df['data'].cat.categories))
+    df['data'] = dates.take(df['data'].cat.codes)
+    return df
+
+
+def read_it_regions(f):
+    return read_it_feed(f, IT_COLUMNS)
+
+
+def read_it_provinces(f):
+    return read_it_feed(f, IT_PROVINCE_COLUMNS)
+
+
 class DataIt(Data):
+    country = 'IT'
+    base_url = os.getenv('DATA_IT_URL', 'https://raw.githubusercontent.com/pcm-dpc/COVID-19/master')
+
+    def _pivot_metrics(self, df):
+        # The long (date, region) feed scattered into a dates x regions frame per metric, regions kept in the order
+        # they appear in the file. A date missing for a region is left as NaN.
+        date_codes, dates = pd.factorize(df['data'], sort=True)
+        region_codes, regions = pd.factorize(df['denominazione_regione'])
+        index = pd.DatetimeIndex(dates, name='date')
+        columns = pd.Index(np.asarray(regions, dtype=object)).append(pd.Index(['Total']))
+        values = np.full((len(IT_METRICS), len(dates), len(columns)), np.nan)
+        values[:, date_codes, region_codes] = df[IT_METRICS].to_numpy().T
+        # The country total of every metric in one aggregation over the regions.
+        values[:, :, -1] = np.nansum(values[:, :, :-1], axis=2)
+        return {column: pd.DataFrame(values[i], index=index, columns=columns) for i, column in enumerate(IT_METRICS)}
+
+    def _pivot_provinces(self, df):
+        # The confirmed cases of the province feed as a dates x provinces frame, a province named by its node.
+        date_codes, dates = pd.factorize(df['data'], sort=True)
+        region_codes, regions = pd.factorize(df['denominazione_regione'])
+        province_codes, provinces = pd.factorize(df['denominazione_provincia'])
+        node_codes, pairs = pd.factorize(region_codes * len(provinces) + province_codes)
+        nodes = [f'{regions[pair // len(provinces)]}{NODE_SEPARATOR}{provinces[pair % len(provinces)]}'
+                 for pair in pairs]
+        values = np.full((len(dates), len(nodes)), np.nan)
+        values[date_codes, node_codes] = df['totale_casi'].to_numpy()
+        return pd.DataFrame(values, index=pd.DatetimeIndex(dates, name='date'), columns=pd.Index(nodes, dtype=object))
+
+    def _fetch_feed(self, feed, reader, stored, missing_ok=False):
+        # The store is seeded once from the full history, afterwards only the latest daily files are parsed.
+        if stored is None or pd.Timestamp.today() - stored.index[-1] > pd.Timedelta(days=IT_RESEED_DAYS):
+            return fetcher.fetch(f'{self.base_url}/dati-{feed}/dpc-covid19-ita-{feed}.csv', reader, missing_ok)
+        dates = pd.date_range(stored.index[-1].normalize() - pd.Timedelta(days=IT_RECHECK_DAYS), pd.Timestamp.today())
+        frames = fetcher.fetch_all(
+            [f'{self.base_url}/dati-{feed}/dpc-covid19-ita-{feed}-{date:%Y%m%d}.csv' for date in dates],
+            reader, missing_ok=True)
+        frames = [df for df in frames if df is not None]
+        return pd.concat(frames, ignore_index=True) if frames else None
 
     def build_data(self):
-        df = pd.read_csv(
-            'https://raw.githubusercontent.com/pcm-dpc/COVID-19/master/dati-regioni/dpc-covid19-ita-regioni.csv')
-        df['data'] = pd.to_datetime(df['data'])
-        df['date'] = df['data']
-        df.set_index(['data', 'codice_regione'], inplace=True)
-        df_cases = pd.DataFrame()
-        df_deaths = pd.DataFrame()
-        df_uci = pd.DataFrame()
-        df_recovered = pd.DataFrame()
-        df_tests = pd.DataFrame()
-        for region in df['denominazione_regione'].unique():
-            df_cases[region] = df[df['denominazione_regione'] == region].set_index('date')['totale_casi']
-            df_cases.rename(columns={'totale_casi': region}, inplace=True)
-
-            df_deaths[region] = df[df['denominazione_regione'] == region].set_index('date')['deceduti']
-            df_deaths.rename(columns={'deceduti': region}, inplace=True)
-
-            df_uci[region] = df[df['denominazione_regione'] == region].set_index('date')['terapia_intensiva']
-            df_uci.rename(columns={'terapia_intensiva': region}, inplace=True)
-
-            df_recovered[region] = df[df['denominazione_regione'] == region].set_index('date')['dimessi_guariti']
-            df_recovered.rename(columns={'dimessi_guariti': region}, inplace=True)
-
-            df_tests[region] = df[df['denominazione_regione'] == region].set_index('date')['tamponi']
-            df_tests.rename(columns={'tamponi': region}, inplace=True)
-
-        df_cases['Total'] = df_cases.sum(axis=1)
-        df_deaths['Total'] = df_deaths.sum(axis=1)
-        df_uci['Total'] = df_uci.sum(axis=1)
-        df_recovered['Total'] = df_recovered.sum(axis=1)
-        df_tests['Total'] = df_tests.sum(axis=1)
-        return df_cases, df_uci, df_deaths, df_recovered
+        stored = None if any(self.stored(column) is None for column in IT_METRICS) else self.stored('totale_casi')
+        df = self._fetch_feed('regioni', read_it_regions, stored)
+        if df is None:
+            metrics = {column: self.stored(column) for column in IT_METRICS}
+        else:
+            metrics = {column: self.update_stored(column, delta)
+                       for column, delta in self._pivot_metrics(df).items()}
+
+        # The province feed is optional: without it the regions are the lowest level.
+        df = self._fetch_feed('province', read_it_provinces, self.stored('province_totale_casi'), missing_ok=True)
+        if df is None:
+            provinces = self.stored('province_totale_casi')
+        else:
+            provinces = self.update_stored('province_totale_casi', self._pivot_provinces(df))
+        return (metrics['totale_casi'], metrics['terapia_intensiva'], metrics['deceduti'], metrics['dimessi_guariti'],
+                provinces)
 
     def dash_title(self):
         return 'Covid-19 Italy Dashboard'
@@ -153,13 +575,22 @@ class DataIt(Data):
 
 
 COUNTRY = os.getenv('COUNTRY')
-COUNTRY_MAPPING = {
-    'IT': DataIt(),
-    'ES': DataEs(),
-}
+COUNTRY_MAPPING = {data.country: data for data in (DataIt(), DataEs())}
+# Countries served by this process, each under /<country code>. COUNTRY is the one served at /, and the only one
+# served when COUNTRIES is not set.
+COUNTRIES = os.getenv('COUNTRIES', COUNTRY or ','.join(COUNTRY_MAPPING)).split(',')
+
+registry.register(Gauge(
+    'dataset_age_seconds', 'Seconds since the dataset served by this process was built.',
+    lambda: [({'country': country}, COUNTRY_MAPPING[country].data_age()) for country in COUNTRIES]))
+
+
+def getData(country=None):
+    if country is None:
+        country = COUNTRY or 'ES'
+    return COUNTRY_MAPPING[country]
 
 
-def getData():
-    if COUNTRY is None:
-        return COUNTRY_MAPPING['ES']
-    return COUNTRY_MAPPING[COUNTRY]
+def country_from_path(pathname):
+    country = (pathname or '/').strip('/').split('/')[0].upper()
+    return country if country in COUNTRIES else None
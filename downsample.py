@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+# Points sent per trace at most, about the width in pixels of a chart. A range narrower than that is sent whole.
+OVERVIEW_POINTS = int(os.getenv('OVERVIEW_POINTS', 600))
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: the indices of `threshold` points keeping the shape of the line. The first and
+    # last points are kept, and in every bucket in between the point making the largest triangle with the point kept
+    # before it and the mean of the next bucket. Gaps (NaN, inf) are kept where they fall, they count as 0.
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    y = np.where(np.isfinite(y), y, 0)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    # The mean point of the bucket after each bucket, all in one array operation.
+    next_starts = edges[1:]
+    sizes = np.diff(np.append(next_starts, n))
+    next_x = (np.add.reduceat(x, next_starts) / sizes).tolist()
+    next_y = (np.add.reduceat(y, next_starts) / sizes).tolist()
+
+    # Only the choice of the previous point is sequential, a plain loop over the few points of each bucket is faster
+    # than numpy calls on them.
+    xs, ys, edges = x.tolist(), y.tolist(), edges.tolist()
+    selected = [0]
+    previous = 0
+    for i in range(threshold - 2):
+        xp, yp, nx, ny = xs[previous], ys[previous], next_x[i], next_y[i]
+        # Twice the area of the triangle (previous, j, next mean) is |a * y_j + b * x_j + c|.
+        a, b, c = xp - nx, ny - yp, nx * yp - xp * ny
+        best_area = -1
+        for j in range(edges[i], edges[i + 1]):
+            area = abs(a * ys[j] + b * xs[j] + c)
+            if area > best_area:
+                best_area, previous = area, j
+        selected.append(previous)
+    selected.append(n - 1)
+    return np.array(selected)
+
+
+def bucket_means(y, buckets):
+    # The mean of y over runs of the same length, ignoring gaps, and the index each run starts at. The runs start at
+    # evenly spaced points, so the dates are still sent as a start and a step.
+    n = len(y)
+    if buckets >= n:
+        return np.arange(n), np.asarray(y)
+    y = np.asarray(y, dtype='float64')
+    starts = np.arange(0, n, -(-n // buckets))
+    finite = np.isfinite(y)
+    totals = np.add.reduceat(np.where(finite, y, 0), starts)
+    counts = np.add.reduceat(finite.astype(int), starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return starts, np.where(counts > 0, totals / counts, np.nan)
+
+
+def downsample_line(x, y, threshold=OVERVIEW_POINTS, position=None):
+    # `position` is the numeric x the triangles are measured on, the index of each point when x are dates.
+    y = np.asarray(y)
+    index = lttb(np.arange(len(y)) if position is None else position, y, threshold)
+    return {'x': x[index], 'y': y[index]}
+
+
+def downsample_bars(x, y, buckets=OVERVIEW_POINTS):
+    starts, means = bucket_means(y, buckets)
+    return {'x': x[starts], 'y': means}
@@ -0,0 +1,63 @@
+import base64
+import os
+
+import numpy as np
+import pandas as pd
+
+# json: plain lists with rounded rates. bdata: base64 typed arrays, which need plotly.js 2.28 or later.
+FIGURE_ENCODING = os.getenv('FIGURE_ENCODING', 'json')
+RATE_DECIMALS = 3
+INT32 = np.iinfo(np.int32)
+
+
+def encode_values(values, encoding=FIGURE_ENCODING):
+    # Whole numbers become int32, anything else float32 (rounded to RATE_DECIMALS in json). NaN and +-inf, as produced
+    # by diff() and by pct_change() on a zero base, are sent as gaps: null in json, NaN in a float32 typed array.
+    array = np.asarray(values, dtype='float64')
+    finite = np.isfinite(array)
+    if finite.all() and (array == np.round(array)).all() and (array.size == 0 or (
+            array.min() >= INT32.min and array.max() <= INT32.max)):
+        typed = array.astype('<i4')
+        if encoding == 'bdata':
+            return {'dtype': 'i4', 'bdata': base64.b64encode(typed.tobytes()).decode()}
+        return typed.tolist()
+
+    if encoding == 'bdata':
+        # Values beyond the float32 range (the doubling curves after a few months) overflow to inf, a gap as well.
+        with np.errstate(over='ignore'):
+            typed = np.where(finite, array, np.nan).astype('<f4')
+        return {'dtype': 'f4', 'bdata': base64.b64encode(typed.tobytes()).decode()}
+    with np.errstate(over='ignore', invalid='ignore'):
+        # Rounding scales by 10 ** RATE_DECIMALS, values that would overflow are too large to need it.
+        rounded = np.round(array, RATE_DECIMALS)
+    rounded = np.where(np.isfinite(rounded), rounded, array)
+    return [value if ok else None for value, ok in zip(rounded.tolist(), finite.tolist())]
+
+
+def encode_axis(trace, axis, encoding=FIGURE_ENCODING):
+    values = trace[axis]
+    if isinstance(values, pd.Series):
+        values = values.to_numpy()
+    if isinstance(values, pd.DatetimeIndex) or (isinstance(values, np.ndarray) and values.dtype.kind == 'M'):
+        dates = pd.DatetimeIndex(values)
+        steps = np.diff(dates.asi8)
+        if len(dates) > 1 and (steps == steps[0]).all():
+            # Evenly spaced dates are sent once as a start and a step in milliseconds.
+            del trace[axis]
+            trace[f'{axis}0'] = dates[0].isoformat()
+            trace[f'd{axis}'] = int(steps[0] // 10 ** 6)
+        else:
+            trace[axis] = [date.isoformat() for date in dates]
+    else:
+        trace[axis] = encode_values(values, encoding)
+
+
+def encode_figure(figure, encoding=FIGURE_ENCODING):
+    traces = []
+    for trace in figure['data']:
+        trace = dict(trace)
+        for axis in ('x', 'y'):
+            if axis in trace:
+                encode_axis(trace, axis, encoding)
+        traces.append(trace)
+    return dict(figure, data=traces)
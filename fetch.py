@@ -0,0 +1,128 @@
+import gzip
+import http.client
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from metrics import fetch_bytes, fetch_duration
+
+
+class FetchError(Exception):
+
+    def __init__(self, url, status):
+        super().__init__(f'GET {url} returned {status}')
+        self.url = url
+        self.status = status
+
+
+class Fetcher:
+    # Downloads several files concurrently over keep-alive connections (one per host and pool thread) and sends
+    # conditional requests, so a file that did not change upstream is neither downloaded nor parsed again. The
+    # validators and parsed content of the max_validated most recently fetched URLs are kept: the per-day files slide
+    # out of the refresh window and are not asked for again.
+
+    def __init__(self, max_workers=4, timeout=30, max_validated=64):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_validated = max_validated
+        self._local = threading.local()
+        self._executor = None
+        self._pid = None
+        self._guard = threading.Lock()
+        self._validated = OrderedDict()
+        self._validated_guard = threading.Lock()
+
+    def _pool(self):
+        if self._pid != os.getpid():
+            with self._guard:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='fetch')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _connection(self, scheme, netloc, fresh=False):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get((scheme, netloc))
+        if connection is None or fresh:
+            if connection is not None:
+                connection.close()
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connection = connections[(scheme, netloc)] = connection_class(netloc, timeout=self.timeout)
+        return connection
+
+    def _request(self, url, headers):
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        for attempt in range(2):
+            # The server may have closed a kept-alive connection since the last refresh, retry once on a new one.
+            connection = self._connection(parts.scheme, parts.netloc, fresh=attempt > 0)
+            try:
+                start = time.perf_counter()
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                fetch_duration.observe(time.perf_counter() - start, host=parts.netloc, status=response.status)
+                fetch_bytes.inc(len(body), host=parts.netloc)
+                return response, body
+            except (http.client.HTTPException, ConnectionError):
+                if attempt > 0:
+                    raise
+
+    def clear(self):
+        with self._validated_guard:
+            self._validated.clear()
+
+    def _validators(self, url):
+        with self._validated_guard:
+            validated = self._validated.get(url)
+            if validated is not None:
+                self._validated.move_to_end(url)
+            return validated
+
+    def _validate(self, url, validated):
+        with self._validated_guard:
+            self._validated[url] = validated
+            self._validated.move_to_end(url)
+            while len(self._validated) > self.max_validated:
+                self._validated.popitem(last=False)
+
+    def shutdown(self):
+        # Stops the pool threads, the next fetch starts a new pool.
+        with self._guard:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = None
+            self._pid = None
+
+    def fetch(self, url, parse, missing_ok=False):
+        headers = {'Accept-Encoding': 'gzip'}
+        validated = self._validators(url)
+        if validated is not None:
+            etag, last_modified, parsed = validated
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response, body = self._request(url, headers)
+        if response.status == 304 and validated is not None:
+            return validated[2]
+        if response.status == 404 and missing_ok:
+            return None
+        if response.status != 200:
+            raise FetchError(url, response.status)
+
+        if response.getheader('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        parsed = parse(io.BytesIO(body))
+        self._validate(url, (response.getheader('ETag'), response.getheader('Last-Modified'), parsed))
+        return parsed
+
+    def fetch_all(self, urls, parse, missing_ok=False):
+        return list(self._pool().map(lambda url: self.fetch(url, parse, missing_ok), urls))
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+
+# Picked up by gunicorn from the working directory: the app is imported once in the master and the data loaded there
+# before the workers are forked, so they start with it already in (copy-on-write) memory.
+preload_app = True
+
+# Every worker writes its metrics in this directory and /metrics renders them all, a new one per server start.
+if 'METRICS_DIR' not in os.environ:
+    os.environ['METRICS_DIR'] = metrics_dir = tempfile.mkdtemp(prefix='covid-19-metrics-')
+else:
+    metrics_dir = None
+
+
+def when_ready(server):
+    from data import getData, COUNTRIES
+
+    for country in COUNTRIES:
+        try:
+            getData(country).warm()
+        except Exception:
+            server.log.exception('Could not preload the %s data, the workers will load it on the first request',
+                                 country)
+
+    # The downloads and cache lookups of the preload are counted once, in the master's file. Its gauges would never be
+    # updated again and are left to the workers.
+    from metrics import registry
+
+    registry.flush(gauges=False)
+
+
+def post_fork(server, worker):
+    from metrics import registry
+
+    registry.reset()
+    registry.start_flushing()
+
+
+def worker_exit(server, worker):
+    # The counts of an exiting worker are still part of the totals.
+    from metrics import registry
+
+    registry.flush()
+
+
+def on_exit(server):
+    if metrics_dir is not None:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,235 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+from profiling import stage
+
+# Prometheus text format metrics of this process. Recording is a dict update under a lock, rendering only happens
+# when /metrics is scraped.
+
+# With several gunicorn workers a scrape reaches any one of them. When METRICS_DIR is set, every process writes its
+# samples there every METRICS_FLUSH_SECONDS and a scrape renders the metrics of all of them.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_SECONDS = 5
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[label] for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[label] for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in values.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', dict(labels, le='+Inf' if bound == float('inf') else bound), cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Gauge:
+    # Read when scraped from `collect`, which returns (labels, value) pairs.
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            if value is not None:
+                yield self.name, labels, value
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+
+    def __init__(self, directory=METRICS_DIR):
+        self.metrics = []
+        self.directory = directory
+        self._pid = None
+        self._guard = threading.Lock()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        if self.directory is None:
+            samples = {metric.name: list(metric.samples()) for metric in self.metrics}
+        else:
+            self.flush()
+            samples = self.merged()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in samples[metric.name]:
+                lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, gauges=True):
+        # The samples of this process, replaced at once so a scrape never reads half a file.
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({metric.name: list(metric.samples()) for metric in self.metrics
+                       if gauges or metric.kind != 'gauge'}, f)
+        os.replace(f'{path}.tmp', path)
+
+    def reset(self):
+        # Counts recorded before a fork belong to the parent, which flushed them in its own file.
+        for metric in self.metrics:
+            if metric.kind != 'gauge':
+                metric.reset()
+
+    def merged(self):
+        # Counters and histograms are summed over every process that wrote samples, exited workers included so that
+        # the totals never go down. Gauges describe a live process and get its pid as a label.
+        merged = {metric.name: {} for metric in self.metrics}
+        for entry in os.listdir(self.directory):
+            if not entry.endswith('.json'):
+                continue
+            pid = int(entry[:-len('.json')])
+            try:
+                with open(os.path.join(self.directory, entry)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = process_alive(pid)
+            for metric in self.metrics:
+                totals = merged[metric.name]
+                for name, labels, value in snapshot.get(metric.name, []):
+                    if metric.kind == 'gauge':
+                        if not alive:
+                            continue
+                        labels = dict(labels, pid=pid)
+                    key = (name, tuple(labels.items()))
+                    if key in totals:
+                        value += totals[key][2]
+                    totals[key] = (name, labels, value)
+        return {name: list(totals.values()) for name, totals in merged.items()}
+
+    def start_flushing(self):
+        # Threads do not survive a fork, every worker starts its own.
+        if self.directory is None or self._pid == os.getpid():
+            return
+        with self._guard:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+
+registry = Registry()
+
+callback_duration = registry.register(Histogram(
+    'dash_callback_duration_seconds', 'Time spent in a Dash callback.', labels=('callback',)))
+cache_requests = registry.register(Counter(
+    'cache_requests_total', 'Cache lookups by cache, key family and result (hit or miss).',
+    labels=('cache', 'family', 'result')))
+cache_evictions = registry.register(Counter(
+    'cache_evictions_total', 'Entries dropped to stay within the cache size, by cache and key family.',
+    labels=('cache', 'family')))
+fetch_duration = registry.register(Histogram(
+    'upstream_fetch_duration_seconds', 'Time spent downloading an upstream file.', labels=('host', 'status')))
+fetch_bytes = registry.register(Counter(
+    'upstream_fetch_bytes_total', 'Bytes received from upstream, before decompression.', labels=('host',)))
+
+
+def timed(callback):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with stage(callback):
+                    return fn(*args, **kwargs)
+            finally:
+                callback_duration.observe(time.perf_counter() - start, callback=callback)
+        return wrapper
+    return decorator
+
+
+def key_family(key):
+    # 'exp:{version}' -> 'exp', 'overviewMadrid:{version}' -> 'overview': the leading lowercase letters of the key.
+    end = 0
+    while end < len(key) and key[end].islower():
+        end += 1
+    return key[:end] or 'other'
@@ -0,0 +1,143 @@
+import contextlib
+import contextvars
+import cProfile
+import heapq
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+
+from flask import request
+
+# Opt-in timing of the stages of a request, sent back in a Server-Timing header, and cProfile dumps of the slowest
+# profiled requests. A request is profiled when PROFILE=1 or when it carries the X-Profile header, otherwise a stage
+# costs one context variable lookup.
+
+PROFILE = os.getenv('PROFILE') == '1'
+PROFILE_HEADER = 'X-Profile'
+# cProfile dumps of the PROFILE_SLOWEST slowest requests are kept per process, 0 disables them. cProfile slows a
+# request down a lot, so only a PROFILE_SAMPLE share of the profiled requests runs under it, or the ones sent with
+# `X-Profile: cprofile`.
+PROFILE_SLOWEST = int(os.getenv('PROFILE_SLOWEST', 0))
+PROFILE_SAMPLE = float(os.getenv('PROFILE_SAMPLE', 0.1))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'covid-19-profiles'))
+
+_profile = contextvars.ContextVar('profile', default=None)
+_no_stage = contextlib.nullcontext()
+# A process runs one cProfile profiler at a time.
+_cprofile_lock = threading.Lock()
+_slowest = []
+_slowest_lock = threading.Lock()
+
+
+class Profile:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # name: [seconds, calls], in the order the stages were first entered.
+        self.stages = {}
+        self.active = set()
+        self.depth = 0
+        # Time spent in the outermost stages, the rest of the request is Dash and Flask.
+        self.staged = 0.0
+        self.profiler = None
+
+    def name(self):
+        return next(iter(self.stages), None) or re.sub(r'\W+', '_', request.path).strip('_') or 'request'
+
+    def stop_profiler(self):
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None:
+            profiler.disable()
+            _cprofile_lock.release()
+        return profiler
+
+    def server_timing(self, total):
+        entries = [f'{name};dur={seconds * 1000:.2f}' + (f';desc="{calls} calls"' if calls > 1 else '')
+                   for name, (seconds, calls) in self.stages.items()]
+        entries.append(f'serialize;dur={max(0.0, total - self.staged) * 1000:.2f};desc="Request parsing and encoding"')
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+class Stage:
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        profile = self.profile
+        profile.stages.setdefault(self.name, [0.0, 0])
+        profile.active.add(self.name)
+        profile.depth += 1
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        profile = self.profile
+        timing = profile.stages[self.name]
+        timing[0] += elapsed
+        timing[1] += 1
+        profile.active.discard(self.name)
+        profile.depth -= 1
+        if not profile.depth:
+            profile.staged += elapsed
+
+
+def stage(name):
+    # `with stage(name):` times a block of a profiled request. A stage entered again inside itself (a derived metric
+    # computing its dependencies) is counted once.
+    profile = _profile.get()
+    if profile is None or name in profile.active:
+        return _no_stage
+    return Stage(profile, name)
+
+
+def keep_slowest(profiler, seconds, name):
+    with _slowest_lock:
+        if len(_slowest) >= PROFILE_SLOWEST and seconds <= _slowest[0][0]:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f'{name}-{seconds * 1000:.0f}ms-{os.getpid()}-{time.time_ns()}.prof')
+        profiler.dump_stats(path)
+        heapq.heappush(_slowest, (seconds, path))
+        if len(_slowest) > PROFILE_SLOWEST:
+            _, path = heapq.heappop(_slowest)
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+
+def profile_requests(server):
+    @server.before_request
+    def start_profile():
+        requested = request.headers.get(PROFILE_HEADER)
+        if not (PROFILE or requested):
+            return
+        profile = Profile()
+        if PROFILE_SLOWEST and (requested == 'cprofile' or random.random() < PROFILE_SAMPLE) and \
+                _cprofile_lock.acquire(blocking=False):
+            profile.profiler = cProfile.Profile()
+            profile.profiler.enable()
+        _profile.set(profile)
+
+    @server.after_request
+    def add_server_timing(response):
+        profile = _profile.get()
+        if profile is not None:
+            profiler = profile.stop_profiler()
+            total = time.perf_counter() - profile.start
+            response.headers['Server-Timing'] = profile.server_timing(total)
+            if profiler is not None:
+                keep_slowest(profiler, total, profile.name())
+        return response
+
+    @server.teardown_request
+    def end_profile(exc):
+        profile = _profile.get()
+        if profile is not None:
+            profile.stop_profiler()
+            _profile.set(None)
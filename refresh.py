@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from profiling import stage
+
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple('Snapshot', ['value', 'built_at'])
+
+
+class Refresher:
+    # Keeps the last built value of `key` in this process and serves it while a background thread rebuilds it before
+    # it expires (stale-while-revalidate). Only the very first load blocks a caller, concurrent misses wait on the
+    # cache lock so a single build runs, and a value stored by another worker is adopted instead of being rebuilt.
+
+    def __init__(self, key, build, cache, max_age_seconds=120, refresh_ratio=0.75, retry_seconds=10, on_load=None):
+        self.key = key
+        self.build = build
+        self.cache = cache
+        self.on_load = on_load
+        self.max_age_seconds = max_age_seconds
+        self.refresh_after = max_age_seconds * refresh_ratio
+        self.retry_seconds = retry_seconds
+        self._snapshot = None
+        self._thread = None
+        self._pid = None
+        self._guard = threading.Lock()
+
+    def get(self, schedule=True):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with stage('data_load'):
+                snapshot = self._load(max_age=self.max_age_seconds)
+        if schedule:
+            self._ensure_scheduler()
+        return snapshot.value
+
+    def age(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return time.time() - snapshot.built_at
+
+    def _shared(self, max_age):
+        snapshot = self.cache.get(self.key)
+        if snapshot is not None and time.time() - snapshot.built_at < max_age:
+            return snapshot
+        return None
+
+    def _load(self, max_age, prepare=False):
+        # With `prepare`, on_load runs on a newer value before it replaces the one served.
+        snapshot = self._shared(max_age)
+        if snapshot is None:
+            with self.cache.lock(self.key):
+                snapshot = self._shared(max_age)
+                if snapshot is None:
+                    snapshot = Snapshot(self.build(), time.time())
+                    self.cache[self.key] = snapshot
+        if self._snapshot is None or snapshot.built_at > self._snapshot.built_at:
+            if prepare and self.on_load is not None:
+                try:
+                    self.on_load(snapshot.value)
+                except Exception:
+                    logger.exception('Preparing the new %s failed, serving it anyway', self.key)
+            self._snapshot = snapshot
+        return snapshot
+
+    def _ensure_scheduler(self):
+        # Threads do not survive a fork, so a worker forked from a preloaded master starts its own.
+        if self._pid == os.getpid():
+            return
+        with self._guard:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name=f'refresh-{self.key}', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            age = self.age()
+            wait = self.refresh_after - age if age is not None else 0
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                self._load(max_age=self.refresh_after, prepare=True)
+            except Exception:
+                logger.exception('Background refresh of %s failed, serving data %.0fs old', self.key, self.age() or 0)
+                time.sleep(self.retry_seconds)
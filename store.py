@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import tempfile
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    STORE_FORMAT = 'parquet'
+except ImportError:
+    STORE_FORMAT = 'pickle'
+
+logger = logging.getLogger(__name__)
+
+
+class Store:
+    # One file per country and metric holding the dates x regions frame, Parquet when pyarrow is installed.
+
+    def __init__(self, directory, store_format=STORE_FORMAT):
+        self.directory = directory
+        self.store_format = store_format
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'{name}.{self.store_format}')
+
+    def load(self, name):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        if self.store_format == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+
+    def save(self, name, df):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            if self.store_format == 'parquet':
+                df.to_parquet(tmp_path)
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, self._path(name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load_json(self, name):
+        try:
+            with open(os.path.join(self.directory, f'{name}.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_json(self, name, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, os.path.join(self.directory, f'{name}.json'))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def merge_frames(stored, delta, name=''):
+    # Dates only in `delta` are appended, dates in both are patched with the values of `delta`.
+    new_dates = delta.index.difference(stored.index)
+    overlap = delta.index.intersection(stored.index)
+    columns = delta.columns.intersection(stored.columns)
+    before, after = stored.loc[overlap, columns], delta.loc[overlap, columns]
+    patched = overlap[~(before.eq(after) | (before.isna() & after.isna())).all(axis=1)]
+    if len(patched):
+        logger.info('Patching %d corrected dates of %s', len(patched), name)
+    if not len(new_dates) and not len(patched) and delta.columns.isin(stored.columns).all():
+        return stored
+
+    columns = stored.columns.append(delta.columns.difference(stored.columns))
+    return delta.combine_first(stored).reindex(columns=columns)
+
+
+def build_store(namespace):
+    return Store(os.path.join(os.getenv('STORE_DIR', os.path.join(tempfile.gettempdir(), 'covid-19-store')), namespace))